@@ -1,10 +1,103 @@
+import time
+# Taken before the imports below, which are most of a cold start
+IMPORT_STARTED = time.perf_counter()
+
+import atexit
+import json
+import logging
+import os
 from flask import Flask
+from app import metrics
+from app.evaluation import DEFAULT_WEIGHTS, parse_weights
+from app.game_store import GameStore
+from app.jobs import AIJobQueue
+from app.mcts import DEFAULT_ITERATIONS
+from app.persistence import GameRepository, SQLiteGameRepository
+from app.solver import DEFAULT_PATH, load_solved_table
+from app.tree_cache import TreeCache
+
+IMPORT_SECONDS = time.perf_counter() - IMPORT_STARTED
+
+logger = logging.getLogger(__name__)
 
 def create_app():
+    started = time.perf_counter()
     app = Flask(__name__)
     app.config['SECRET_KEY'] = 'your-secret-key-here'
+    # Answer moves from the solved table unless a request asks for live search
+    app.config['LIVE_SEARCH'] = False
+    # Seconds the AI may spend on one move before answering with its best so far
+    app.config['MOVE_TIME_LIMIT'] = 1.0
+    # Plies the AI searches before scoring positions with the evaluator, requests may
+    # send their own search_depth. None searches to the end of the game or the time limit.
+    app.config['SEARCH_DEPTH'] = None
+    # Evaluator weights of a line open to one side only, by how many more stones
+    # it needs: the first when one more wins it, see app.evaluation. EVAL_WEIGHTS=3,1 sets them.
+    app.config['EVAL_WEIGHTS'] = parse_weights(os.environ.get('EVAL_WEIGHTS') or DEFAULT_WEIGHTS)
+    # Iterations of a Monte Carlo tree search per move or tree, moves stop sooner at the time limit
+    app.config['MCTS_ITERATIONS'] = int(os.environ.get('MCTS_ITERATIONS') or DEFAULT_ITERATIONS)
+    # Processes searching root moves in parallel on large boards, 0 or 1 to search serially
+    app.config['SEARCH_WORKERS'] = 0
+    # AI moves requested with async run on a bounded pool and are polled at /jobs/<id>
+    app.config['ASYNC_AI'] = False
+    app.config['AI_JOB_WORKERS'] = 4
+    app.config['MAX_PENDING_AI_JOBS'] = 64
+    app.config['JOB_MAX_WAIT'] = 25
+    app.config['SOLVED_TABLE_PATH'] = DEFAULT_PATH
+    # Games live in process memory: cap how many and drop idle ones
+    app.config['MAX_LIVE_GAMES'] = 10000
+    app.config['GAME_IDLE_TIMEOUT'] = 1800
+    # SQLite file games and their moves are kept in, unset keeps them in memory only.
+    # Writes are batched off the request path and flushed at least every interval.
+    app.config['GAME_DB_PATH'] = os.environ.get('GAME_DB_PATH')
+    app.config['GAME_DB_FLUSH_INTERVAL'] = 0.5
+    app.config['GAME_DB_BATCH_SIZE'] = 500
+    app.config['MAX_EVALUATE_BOARDS'] = 1000
+    # Decision tree size: default depth, levels added per expand, and hard caps
+    app.config['TREE_DEPTH'] = 3
+    app.config['TREE_EXPAND_DEPTH'] = 2
+    app.config['MAX_TREE_DEPTH'] = 6
+    app.config['MAX_TREE_NODES'] = 20000
+    # Built trees shared across games, and how long clients may reuse a tree response
+    app.config['TREE_CACHE_SIZE'] = 512
+    app.config['TREE_CACHE_MAX_AGE'] = 3600
+
+    # Profile searches: 'off', 'always', or 'header' for requests sending X-Profile.
+    # Profiles are kept at /profiles/<profile_id>.
+    app.config['PROFILING'] = 'off'
+
+    configured = time.perf_counter()
+    load_solved_table(app.config['SOLVED_TABLE_PATH'])
+    solved = time.perf_counter()
+    if app.config['GAME_DB_PATH']:
+        repository = SQLiteGameRepository(app.config['GAME_DB_PATH'], app.config['GAME_DB_FLUSH_INTERVAL'],
+                                          app.config['GAME_DB_BATCH_SIZE'])
+        # Write what is still pending on the way out
+        atexit.register(repository.close)
+    else:
+        repository = GameRepository()
+    app.extensions['game_store'] = GameStore(app.config['MAX_LIVE_GAMES'], app.config['GAME_IDLE_TIMEOUT'],
+                                             repository)
+    app.extensions['tree_cache'] = TreeCache(app.config['TREE_CACHE_SIZE'])
+    app.extensions['ai_jobs'] = AIJobQueue(app.config['AI_JOB_WORKERS'], app.config['MAX_PENDING_AI_JOBS'],
+                                           on_move=app.extensions['game_store'].save)
+    services = time.perf_counter()
     
     from app import routes
     app.register_blueprint(routes.main)
+    metrics.init_app(app)
+    finished = time.perf_counter()
+
+    # Cold start by phase, in seconds. Engines are not built here, each game
+    # builds the ones it uses. Served as gauges at /metrics.
+    app.extensions['startup'] = {
+        'imports': IMPORT_SECONDS,
+        'config': configured - started,
+        'solved_table': solved - configured,
+        'services': services - solved,
+        'routes': finished - services,
+        'create_app': finished - started
+    }
+    logger.info(json.dumps(dict(event='startup', **app.extensions['startup']), separators=(',', ':')))
     
     return app
\ No newline at end of file
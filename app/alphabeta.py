@@ -1,218 +1,429 @@
 # Last updated: 2025-04-10 17:40:52 UTC
 # Author: its-lightning
 
-from typing import List, Dict, Tuple, Optional, Set
+import time
+from typing import Callable, List, Dict, Generator, Iterator, Sequence, Tuple, Optional, Set
+from app import parallel
+from app.batch_eval import static_scores
+from app.bitboard import Bitboard, BoardSpec, STANDARD, player_to_move
+from app.evaluation import DEFAULT_WEIGHTS, LineCounters, evaluator
+from app.move_ordering import MoveOrderer
+from app.search_memory import RetainedSearch, resume_search
+from app.search_stats import SearchStats
+from app.solver import get_solved_table
+from app.transposition import TranspositionTable, EXACT, LOWER, UPPER, FULL_DRAFT, from_table_score, shared_table
+from app.tree import ROOT_ID, EXPANDABLE, PRUNED, CompactTree, TreeNode, pack_board
+
+# How many nodes are searched between two looks at the clock
+DEADLINE_CHECK_INTERVAL = 1024
+
+
+class SearchTimeout(Exception):
+    """Raised inside the search when the move's time budget runs out."""
+
 
 class AlphaBetaAI:
-    def __init__(self):
+    def __init__(self, spec: BoardSpec = STANDARD, table: Optional[TranspositionTable] = None):
+        self.spec = spec
         self.ai_player = 'O'
         self.human_player = 'X'
         self.nodes_explored = 0
-        self.pruned_nodes = set()
-
-    def is_winner(self, board: List[str], player: str) -> bool:
-        # Check rows
-        for i in range(0, 9, 3):
-            if board[i] == board[i+1] == board[i+2] == player:
-                return True
-        
-        # Check columns
-        for i in range(3):
-            if board[i] == board[i+3] == board[i+6] == player:
-                return True
-        
-        # Check diagonals
-        if board[0] == board[4] == board[8] == player:
-            return True
-        if board[2] == board[4] == board[6] == player:
-            return True
-        
-        return False
-
-    def get_empty_cells(self, board: List[str]) -> List[int]:
-        return [i for i, cell in enumerate(board) if cell == '']
-
-    def get_current_player(self, board: List[str]) -> str:
-        """Determine whose turn it is based on the board state."""
-        x_count = board.count('X')
-        o_count = board.count('O')
-        return 'X' if x_count <= o_count else 'O'
-
-    def evaluate_position(self, board: List[str]) -> int:
-        if self.is_winner(board, self.ai_player):
-            return 10
-        elif self.is_winner(board, self.human_player):
-            return -10
-        elif '' not in board:
-            return 0
-        
-        score = 0
-        lines = [
-            [0, 1, 2], [3, 4, 5], [6, 7, 8],  # rows
-            [0, 3, 6], [1, 4, 7], [2, 5, 8],  # columns
-            [0, 4, 8], [2, 4, 6]  # diagonals
-        ]
-        
-        for line in lines:
-            ai_count = sum(1 for i in line if board[i] == self.ai_player)
-            human_count = sum(1 for i in line if board[i] == self.human_player)
-            empty_count = sum(1 for i in line if board[i] == '')
-            
-            if ai_count == 2 and empty_count == 1:
-                score += 3
-            elif human_count == 2 and empty_count == 1:
-                score -= 3
-            elif ai_count == 1 and empty_count == 2:
-                score += 1
-            elif human_count == 1 and empty_count == 2:
-                score -= 1
-        
-        return score
-
-    def generate_tree(self, board: List[str], max_depth: int = 4) -> Dict:
+        self.table_hits = 0
+        self.table = table if table is not None else shared_table
+        self.live_search = False  # Skip the solved table and always search
+        self.solved_lookup = False
+        self.pruned_nodes = set()  # Numbers of the last tree's pruned leaves
+        # Iterative deepening state
+        self.deadline = None
+        self.cancel_requested = False
+        # Asked with the clock whether the parent of a pool search gave up, see parallel.search_child
+        self.aborted: Optional[Callable[[], bool]] = None
+        self.horizon_reached = False
+        self.completed_depth = 0
+        self.best_score = None  # Value of the last get_best_move root for O
+        self.reused_search = False  # The last search was re-rooted from the previous move's
+        self.tree_truncated = False  # The last tree hit its node ceiling
+        # Move ordering, switch off to measure what it saves
+        self.move_ordering = True
+        self.orderer = MoveOrderer(spec)
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0  # Cutoffs by the first move tried, the ordering's hit rate
+        self.stats = SearchStats(spec.cells)
+        # Root moves go to a process pool when workers > 1 and the root has enough empty cells
+        self.workers = 0
+        self.parallel_min_empty = parallel.PARALLEL_MIN_EMPTY
+        # Plies searched before leaves are scored by the evaluator, None searches
+        # to the end of the game or as deep as the time limit allows
+        self.search_depth = None
+        self.set_weights(DEFAULT_WEIGHTS)
+
+    def set_weights(self, weights: Tuple[int, ...]) -> None:
+        self.evaluator = evaluator(self.spec, weights)
+        # Heuristic leaf scores are scaled into (-1, 1), below any win or loss
+        self.heuristic_scale = self.evaluator.scale
+
+    def is_winner(self, board: Bitboard, player: str) -> bool:
+        return self.spec.is_win(board[0] if player == 'X' else board[1])
+
+    def get_empty_cells(self, board: Bitboard) -> List[int]:
+        return list(self.spec.moves(self.spec.full ^ (board[0] | board[1])))
+
+    def order_moves(self, x: int, o: int, empty: int, ply: int, is_maximizing: bool,
+                    hash_move: Optional[int] = None) -> Sequence[int]:
+        if not self.move_ordering:
+            return self.spec.moves(empty)
+        if is_maximizing:
+            return self.orderer.order(o, x, empty, ply, True, hash_move)
+        return self.orderer.order(x, o, empty, ply, False, hash_move)
+
+    def record_cutoff(self, move: int, index: int, moves: int, ply: int, is_maximizing: bool, empty: int) -> None:
+        self.cutoffs += 1
+        if index == 0:
+            self.first_move_cutoffs += 1
+        remaining = empty.bit_count()
+        self.stats.record_cutoff(ply, moves - index - 1, remaining)
+        if self.move_ordering:
+            self.orderer.record_cutoff(move, ply, is_maximizing, remaining)
+
+    def cancel(self) -> None:
+        """Stop the running search from another thread, through the deadline check."""
+        self.cancel_requested = True
+        self.deadline = float('-inf')
+
+    def evaluate_position(self, board: Bitboard) -> int:
+        return self.evaluator.evaluate(board)
+
+    def generate_tree(self, board: Bitboard, max_depth: int = 4, depth: int = 0,
+                      root_id: str = ROOT_ID, max_nodes: Optional[int] = None) -> Dict:
+        return self.build_tree(board, max_depth, depth, root_id, max_nodes).to_dict()
+
+    def build_tree(self, board: Bitboard, max_depth: int = 4, depth: int = 0,
+                   root_id: str = ROOT_ID, max_nodes: Optional[int] = None) -> CompactTree:
+        tree = CompactTree.from_nodes(self.spec, self.iter_tree(board, max_depth, depth, max_nodes),
+                                      max_depth, depth, root_id)
+        tree.nodes_explored = self.nodes_explored
+        tree.truncated = self.tree_truncated
+        return tree
+
+    def iter_tree(self, board: Bitboard, max_depth: int = 4, depth: int = 0,
+                  max_nodes: Optional[int] = None) -> Iterator[TreeNode]:
+        """Yield the pruned tree's nodes while it is being built.
+
+        Nodes come out in post-order, see TicTacToeAI.iter_tree. A subtree
+        grown from a node is searched with a full window of its own.
+        """
         self.nodes_explored = 0
+        self.tree_truncated = False
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
         self.pruned_nodes.clear()
+        self.orderer.clear()
+        self.stats.reset()
+        spec = self.spec
+        created = 1
+        numbered = 0
+        start_depth = depth
 
-        tree = {
-            'nodes': [],
-            'edges': [],
-            'maxDepth': max_depth,
-            'nodesExplored': 0
-        }
+        def new_node(parent: Optional[TreeNode], move: int, board_state: Bitboard, depth: int) -> TreeNode:
+            # Pruned leaves are numbered too but do not count as explored
+            nonlocal numbered
+            numbered += 1
+            return TreeNode(numbered - 1, parent, move, pack_board(spec, board_state), depth)
 
-        def create_node(board_state: List[str], depth: int, alpha: float, beta: float, 
-                        parent_id: Optional[str] = None) -> Tuple[str, float]:
-            # Generate a unique node ID by including parent_id in the hash
-            node_id = str(hash((tuple(board_state), depth, parent_id)))
+        def create_node(board_state: Bitboard, depth: int, alpha: float, beta: float,
+                        parent: Optional[TreeNode] = None, move: int = -1,
+                        static: Optional[int] = None) -> Generator[TreeNode, None, float]:
+            nonlocal created
+            node = new_node(parent, move, board_state, depth)
+            self.nodes_explored += 1
+            self.stats.nodes_by_ply[depth - start_depth] += 1
+            x, o = board_state
 
             # Determine current player based on board state
-            x_count = board_state.count('X')
-            o_count = board_state.count('O')
-            current_player = 'X' if x_count <= o_count else 'O'
-            is_maximizing = current_player == self.ai_player
-
-            score = self.evaluate_position(board_state)
-
-            # Add node to tree
-            tree['nodes'].append({
-                'id': node_id,
-                'board': board_state.copy(),
-                'score': score,
-                'depth': depth,
-                'isPruned': node_id in self.pruned_nodes,
-                'currentPlayer': current_player
-            })
-            tree['nodesExplored'] += 1
-
-            # Add edge if this isn't the root
-            if parent_id is not None:
-                tree['edges'].append({
-                    'from': parent_id,
-                    'to': node_id,
-                    'isPruned': node_id in self.pruned_nodes
-                })
-
-            # Base cases
-            if depth >= max_depth or self.is_winner(board_state, self.ai_player) or \
-            self.is_winner(board_state, self.human_player) or not self.get_empty_cells(board_state):
-                return node_id, score
-
-            empty_cells = self.get_empty_cells(board_state)
-
-            if is_maximizing:  # AI's turn (O)
-                max_eval = float('-inf')
-                for pos in empty_cells:
-                    new_board = board_state.copy()
-                    new_board[pos] = self.ai_player
-                    _, eval_score = create_node(new_board, depth + 1, alpha, beta, node_id)
-                    max_eval = max(max_eval, eval_score)
-                    alpha = max(alpha, eval_score)
-                    if beta <= alpha:
-                        break
-                # Update node score
-                for node in tree['nodes']:
-                    if node['id'] == node_id:
-                        node['score'] = max_eval
-                        break
-                return node_id, max_eval
-            else:  # Player's turn (X)
-                min_eval = float('inf')
-                for pos in empty_cells:
-                    new_board = board_state.copy()
-                    new_board[pos] = self.human_player
-                    _, eval_score = create_node(new_board, depth + 1, alpha, beta, node_id)
-                    min_eval = min(min_eval, eval_score)
-                    beta = min(beta, eval_score)
-                    if beta <= alpha:
-                        break
-                # Update node score
-                for node in tree['nodes']:
-                    if node['id'] == node_id:
-                        node['score'] = min_eval
-                        break
-                return node_id, min_eval
-
-        # Start tree generation
-        root_id, _ = create_node(board, 0, float('-inf'), float('inf'))
-        tree['nodesExplored'] = self.nodes_explored
-        return tree
-    def get_best_move(self, board: List[str]) -> Tuple[Optional[int], int]:
+            is_maximizing = player_to_move(board_state) == self.ai_player
+
+            score = static if static is not None else self.evaluate_position(board_state)
+            empty = spec.full ^ (x | o)
+            terminal = spec.is_win(o) or spec.is_win(x) or not empty
+
+            # Expand unless this is a leaf. Children skipped by a cutoff are
+            # still shown, as pruned leaves, so they count against the ceiling.
+            moves = [] if depth >= max_depth or terminal else \
+                list(self.order_moves(x, o, empty, depth - start_depth, is_maximizing))
+            if moves and max_nodes is not None and created + len(moves) > max_nodes:
+                self.tree_truncated = True
+                moves = []
+            created += len(moves)
+
+            # Leaf children are scored together, see static_scores
+            statics = [None] * len(moves)
+            if moves and depth + 1 >= max_depth:
+                statics = static_scores(spec, [(x, o | 1 << pos) if is_maximizing else (x | 1 << pos, o)
+                                               for pos in moves], self.evaluate_position, self.evaluator.weights)
+
+            if moves:
+                if is_maximizing:  # AI's turn (O)
+                    max_eval = float('-inf')
+                    for i, pos in enumerate(moves):
+                        eval_score = yield from create_node((x, o | 1 << pos), depth + 1, alpha, beta,
+                                                            node, pos, statics[i])
+                        max_eval = max(max_eval, eval_score)
+                        alpha = max(alpha, eval_score)
+                        if beta <= alpha:
+                            self.record_cutoff(pos, i, len(moves), depth - start_depth, True, empty)
+                            yield from pruned_children(board_state, depth, node, moves[i + 1:])
+                            break
+                    score = max_eval
+                else:  # Player's turn (X)
+                    min_eval = float('inf')
+                    for i, pos in enumerate(moves):
+                        eval_score = yield from create_node((x | 1 << pos, o), depth + 1, alpha, beta,
+                                                            node, pos, statics[i])
+                        min_eval = min(min_eval, eval_score)
+                        beta = min(beta, eval_score)
+                        if beta <= alpha:
+                            self.record_cutoff(pos, i, len(moves), depth - start_depth, False, empty)
+                            yield from pruned_children(board_state, depth, node, moves[i + 1:])
+                            break
+                    score = min_eval
+
+            node.score = score
+            if not (terminal or moves):
+                node.flags = EXPANDABLE
+            yield node
+            return score
+
+        def pruned_children(board_state: Bitboard, depth: int, parent: TreeNode,
+                            moves: List[int]) -> Iterator[TreeNode]:
+            x, o = board_state
+            is_maximizing = player_to_move(board_state) == self.ai_player
+            for pos in moves:
+                child = (x, o | 1 << pos) if is_maximizing else (x | 1 << pos, o)
+                node = new_node(parent, pos, child, depth + 1)
+                node.score = self.evaluate_position(child)
+                node.flags = PRUNED
+                self.pruned_nodes.add(node.index)
+                yield node
+
+        yield from create_node(board, depth, float('-inf'), float('inf'))
+        self.stats.finish_iteration(max_depth - start_depth)
+
+    def get_best_move(self, board: Bitboard, time_limit: Optional[float] = None,
+                      previous: Optional[RetainedSearch] = None) -> Tuple[Optional[int], int]:
+        """Full search, or iterative deepening when a time_limit (seconds) or a
+        search_depth is given, stopping at whichever comes first.
+
+        previous is the game's search for its last move, see search_memory.
+        """
         self.nodes_explored = 0
+        self.table_hits = 0
+        self.solved_lookup = False
+        self.completed_depth = 0
+        self.best_score = None
+        self.reused_search = False
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
         self.pruned_nodes.clear()
-        empty_cells = self.get_empty_cells(board)
+        self.orderer.clear()
+        self.stats.reset()
+        self.cancel_requested = False
+        x, o = board
+        empty = self.spec.full ^ (x | o)
+
+        if not self.live_search and self.spec is STANDARD:
+            solved = get_solved_table()
+            answer = solved.best_move(board) if solved is not None else None
+            if answer is not None:
+                self.solved_lookup = True
+                move, self.best_score = answer
+                return move, self.nodes_explored
+
+        if not empty:
+            return None, self.nodes_explored
+
+        # Pick up below the previous search, its next principal move is tried first
+        continuation = resume_search(self, previous, board)
+        self.reused_search = continuation is not None
+        expected = continuation[0] if continuation and empty >> continuation[0] & 1 else None
+
+        # Root children are searched at depth 0, so the root itself sits at -1
+        entry = self.table.probe(self.spec, x, o, True, -1)
+        if entry is not None and entry[0] == EXACT and entry[2] is not None and empty >> entry[2] & 1:
+            self.table_hits += 1
+            self.best_score = from_table_score(entry[1], 1)
+            return entry[2], self.nodes_explored
+
+        if time_limit is None and self.search_depth is None:
+            self.horizon_reached = False
+            best_move, best_score = self.search_root(x, o, None, expected)
+            self.completed_depth = empty.bit_count()
+            self.stats.finish_iteration(self.completed_depth)
+        else:
+            best_move, best_score = self.iterative_deepening(x, o, time_limit, expected)
+        # Shift win/loss scores from the children's depth-0 frame to the root's
+        self.best_score = from_table_score(best_score, 1) if best_move is not None else None
+        return best_move, self.nodes_explored
+
+    def iterative_deepening(self, x: int, o: int, time_limit: Optional[float],
+                            first_move: Optional[int] = None) -> Tuple[Optional[int], float]:
+        deadline = time.perf_counter() + time_limit if time_limit is not None else None
+        best_move = first_move
+        best_score = float('-inf')
+        last = (self.spec.full ^ (x | o)).bit_count()
+        if self.search_depth is not None:
+            last = min(last, self.search_depth)
+        try:
+            for limit in range(1, last + 1):
+                if self.cancel_requested:
+                    raise SearchTimeout()
+                # The one-ply pass always completes so there is a move to fall back on
+                self.deadline = deadline if limit > 1 else None
+                self.horizon_reached = False
+                best_move, best_score = self.search_root(x, o, limit - 1, best_move)
+                self.completed_depth = limit
+                self.stats.finish_iteration(limit)
+                if not self.horizon_reached:
+                    break  # Every line reached the end of the game
+        except SearchTimeout:
+            self.stats.finish_iteration(self.completed_depth + 1, completed=False)
+        finally:
+            self.deadline = None
+        return best_move, best_score
+
+    def search_root(self, x: int, o: int, max_depth: Optional[int],
+                    first_move: Optional[int] = None) -> Tuple[Optional[int], float]:
+        # The previous iteration's choice goes first for an early cutoff bound
+        moves = self.order_moves(x, o, self.spec.full ^ (x | o), 0, True, first_move)
+        if first_move is not None and not self.move_ordering:
+            moves = (first_move,) + tuple(pos for pos in moves if pos != first_move)
+
         best_score = float('-inf')
         best_move = None
         alpha = float('-inf')
         beta = float('inf')
 
-        for pos in empty_cells:
-            new_board = board.copy()
-            new_board[pos] = self.ai_player
-            score = self.alpha_beta(new_board, 0, alpha, beta, False)[0]
-            if score > best_score:
-                best_score = score
-                best_move = pos
-            alpha = max(alpha, score)
+        if self.workers > 1 and len(moves) >= self.parallel_min_empty:
+            best_move, best_score = parallel.search_root(self, x, o, moves, max_depth)
+        else:
+            lines = self.evaluator.counters((x, o)) if max_depth is not None else None
+            for pos in moves:
+                if lines is not None:
+                    lines.play(pos, True)
+                score = self.alpha_beta(x, o | 1 << pos, 0, alpha, beta, False, max_depth, lines)[0]
+                if lines is not None:
+                    lines.undo(pos, True)
+                if score > best_score:
+                    best_score = score
+                    best_move = pos
+                alpha = max(alpha, score)
+
+        if best_move is not None and not self.horizon_reached:
+            self.table.store(self.spec, x, o, True, -1, EXACT, best_score, best_move)
+        return best_move, best_score
 
-        return best_move, self.nodes_explored
+    def alpha_beta(self, x: int, o: int, depth: int, alpha: float, beta: float, is_maximizing: bool,
+                   max_depth: Optional[int] = None,
+                   lines: Optional[LineCounters] = None) -> Tuple[float, Optional[int]]:
+        """Value of the position for O within the window and the best move from it.
 
-    def alpha_beta(self, board: List[str], depth: int, alpha: float, beta: float, 
-                  is_maximizing: bool) -> Tuple[int, Optional[int]]:
+        Positions max_depth deep are scored by the evaluator, from lines when
+        the caller keeps this position's counters.
+        """
         self.nodes_explored += 1
-        empty_cells = self.get_empty_cells(board)
-        
-        if self.is_winner(board, self.ai_player):
-            return 10 - depth, None
-        if self.is_winner(board, self.human_player):
-            return depth - 10, None
-        if not empty_cells:
+        # Root children are searched at depth 0, one ply below the root
+        self.stats.nodes_by_ply[depth + 1] += 1
+        if self.deadline is not None and not self.nodes_explored % DEADLINE_CHECK_INTERVAL \
+                and (time.perf_counter() > self.deadline or self.aborted is not None and self.aborted()):
+            raise SearchTimeout()
+        spec = self.spec
+
+        if spec.is_win(o):
+            return spec.win_score - depth, None
+        if spec.is_win(x):
+            return depth - spec.win_score, None
+        empty = spec.full ^ (x | o)
+        if not empty:
             return 0, None
 
+        if max_depth is not None and depth >= max_depth:
+            self.horizon_reached = True
+            score = lines.score if lines is not None else self.evaluator.heuristic((x, o))
+            return score / self.heuristic_scale, None
+        draft = FULL_DRAFT if max_depth is None else max_depth - depth
+
+        alpha_orig, beta_orig = alpha, beta
+        hash_move = None
+        entry = self.table.probe(spec, x, o, is_maximizing, depth, draft, self.evaluator.weights)
+        if entry is not None:
+            flag, score, move, entry_draft = entry
+            if entry_draft < FULL_DRAFT:
+                # The stored value itself rests on heuristic leaves
+                self.horizon_reached = True
+            if flag == EXACT:
+                self.table_hits += 1
+                return score, move
+            if flag == LOWER:
+                alpha = max(alpha, score)
+            elif flag == UPPER:
+                beta = min(beta, score)
+            if beta <= alpha:
+                self.table_hits += 1
+                return score, move
+            hash_move = move
+
+        moves = self.order_moves(x, o, empty, depth + 1, is_maximizing, hash_move)
         if is_maximizing:
             max_eval = float('-inf')
             best_move = None
-            for pos in empty_cells:
-                board[pos] = self.ai_player
-                eval_score, _ = self.alpha_beta(board, depth + 1, alpha, beta, False)
-                board[pos] = ''
+            # Nothing beats winning with the next move
+            best_possible = spec.win_score - depth - 1
+            for i, pos in enumerate(moves):
+                if lines is not None:
+                    lines.play(pos, True)
+                eval_score, _ = self.alpha_beta(x, o | 1 << pos, depth + 1, alpha, beta, False, max_depth, lines)
+                if lines is not None:
+                    lines.undo(pos, True)
                 if eval_score > max_eval:
                     max_eval = eval_score
                     best_move = pos
                 alpha = max(alpha, eval_score)
                 if beta <= alpha:
+                    self.record_cutoff(pos, i, len(moves), depth + 1, True, empty)
+                    break
+                if eval_score >= best_possible:
                     break
+            self.store_result(x, o, is_maximizing, depth, max_eval, best_move, alpha_orig, beta_orig, draft)
             return max_eval, best_move
         else:
             min_eval = float('inf')
             best_move = None
-            for pos in empty_cells:
-                board[pos] = self.human_player
-                eval_score, _ = self.alpha_beta(board, depth + 1, alpha, beta, True)
-                board[pos] = ''
+            best_possible = depth + 1 - spec.win_score
+            for i, pos in enumerate(moves):
+                if lines is not None:
+                    lines.play(pos, False)
+                eval_score, _ = self.alpha_beta(x | 1 << pos, o, depth + 1, alpha, beta, True, max_depth, lines)
+                if lines is not None:
+                    lines.undo(pos, False)
                 if eval_score < min_eval:
                     min_eval = eval_score
                     best_move = pos
                 beta = min(beta, eval_score)
                 if beta <= alpha:
+                    self.record_cutoff(pos, i, len(moves), depth + 1, False, empty)
                     break
-            return min_eval, best_move
\ No newline at end of file
+                if eval_score <= best_possible:
+                    break
+            self.store_result(x, o, is_maximizing, depth, min_eval, best_move, alpha_orig, beta_orig, draft)
+            return min_eval, best_move
+
+    def store_result(self, x: int, o: int, is_maximizing: bool, depth: int, score: float,
+                     best_move: Optional[int], alpha: float, beta: float, draft: int = FULL_DRAFT) -> None:
+        # Classify the result against the window the node was searched with
+        if score <= alpha:
+            flag = UPPER
+        elif score >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.table.store(self.spec, x, o, is_maximizing, depth, flag, score, best_move, draft,
+                         self.evaluator.weights)
@@ -0,0 +1,83 @@
+import time
+from typing import Dict, List, Optional, Tuple
+from app.batch_eval import batch_evaluator
+from app.bitboard import Bitboard, BoardSpec
+from app.game_logic import ENGINES, MAX_MINMAX_CELLS
+
+
+def evaluate_positions(spec: BoardSpec, positions: List[Tuple[Bitboard, str]], algorithm: str = 'alphabeta',
+                       live_search: bool = False, time_limit: Optional[float] = None) -> Dict:
+    """Best move and minimax score for each (board, side to move) pair.
+
+    Scores are from the point of view of the side to move, static_score is
+    evaluate_position of the board without search. Positions that are
+    identical up to a board symmetry (or a colour swap with the other side to
+    move) are searched once; later copies report duplicate_of and zero nodes.
+    mcts scores are expected results from -1 to 1 rather than plies to a win.
+
+    time_limit (seconds) is for the whole batch: each search gets an even
+    share of what is left of it among the positions still to go.
+    """
+    if algorithm not in ENGINES:
+        raise ValueError('Unknown algorithm: %s' % algorithm)
+    if algorithm == 'minmax' and spec.cells > MAX_MINMAX_CELLS:
+        raise ValueError('MinMax only supports boards up to %d cells, use alphabeta' % MAX_MINMAX_CELLS)
+
+    ai = ENGINES[algorithm](spec)
+    ai.live_search = live_search
+
+    # The engines always play O, so X to move is searched on the colour-swapped board
+    boards = [board if to_move == 'O' else (board[1], board[0]) for board, to_move in positions]
+    # Win flags and static scores for the whole batch in one pass
+    o_wins, x_wins, statics = batch_evaluator(spec).evaluate(batch_evaluator(spec).to_array(boards))
+
+    deadline = time.perf_counter() + time_limit if time_limit is not None else None
+    results = []
+    searched = {}  # canonical key -> (index, transform, best move, score)
+    total_nodes = 0
+    for index, (x, o) in enumerate(boards):
+        static = int(statics[index])
+        key, transform = spec.canonical(x, o)
+
+        if key in searched:
+            first_index, first_transform, move, score = searched[key]
+            if move is not None:
+                # Map the move through the shared canonical form onto this board
+                move = spec.symmetries[transform][spec.symmetries[first_transform].index(move)]
+            results.append({
+                'best_move': move,
+                'score': score,
+                'static_score': static,
+                'nodes_explored': 0,
+                'duplicate_of': first_index
+            })
+            continue
+
+        if x_wins[index]:
+            move, score, nodes = None, -spec.win_score, 0
+        elif o_wins[index]:
+            move, score, nodes = None, spec.win_score, 0
+        elif not spec.full ^ (x | o):
+            move, score, nodes = None, 0, 0
+        else:
+            budget = None
+            if deadline is not None:
+                budget = max(deadline - time.perf_counter(), 0.0) / (len(boards) - index)
+            move, nodes = ai.get_best_move((x, o), budget)
+            score = ai.best_score
+
+        searched[key] = (index, transform, move, score)
+        total_nodes += nodes
+        results.append({
+            'best_move': move,
+            'score': score,
+            'static_score': static,
+            'nodes_explored': nodes,
+            'duplicate_of': None
+        })
+
+    return {
+        'results': results,
+        'unique_positions': len(searched),
+        'nodes_explored': total_nodes
+    }
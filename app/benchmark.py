@@ -0,0 +1,346 @@
+# Benchmarks for the search engines and the HTTP endpoints. Engines are timed
+# over a fixed corpus of 3x3 positions, each searched for O; endpoints are load
+# tested through the Flask test client from a pool of threads, one client
+# (and so one game) per simulated player. Depth-limited search is compared
+# with full search on every 3x3 position with O to move, its moves checked
+# against the solved table. Cold starts are timed in fresh interpreters,
+# from launch to the answer to a first move. Results are written as JSON so
+# two runs can be compared:
+#
+#   python -m app.benchmark --repeat 20 --concurrency 8 --output bench.json
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from app.bitboard import STANDARD, Bitboard
+from app.evaluation import DEFAULT_WEIGHTS, parse_weights
+from app.game_logic import ENGINES
+from app.solver import get_solved_table, load_solved_table
+from app.transposition import TranspositionTable
+
+CORPUS = {
+    'empty': ['', '', '',
+              '', '', '',
+              '', '', ''],
+    'opening_corner': ['X', '', '',
+                       '', '', '',
+                       '', '', ''],
+    'opening_edge': ['', 'X', '',
+                     '', '', '',
+                     '', '', ''],
+    'midgame_fork_threat': ['X', '', '',
+                            '', 'O', '',
+                            '', '', 'X'],
+    'midgame_block': ['X', 'X', '',
+                      '', 'O', '',
+                      '', '', ''],
+    'midgame_open': ['X', '', '',
+                     '', 'O', 'X',
+                     '', 'X', 'O'],
+    'near_terminal_win': ['X', 'X', 'O',
+                          '', 'O', 'X',
+                          '', '', ''],
+    'near_terminal_draw': ['X', 'O', 'X',
+                           'X', 'O', 'O',
+                           '', 'X', '']
+}
+
+# Moves X plays in each load test game, skipping any the AI has taken
+LOAD_TEST_MOVES = [4, 0, 8, 2, 6, 1, 3, 5, 7]
+
+# Run in a fresh interpreter per cold start, prints its phase times as JSON
+COLD_START = '''
+import json, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app()
+created = time.perf_counter()
+with app.test_client() as client:
+    client.post('/make_move', json={'position': 4})
+moved = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create_app': created - imported, 'first_move': moved - created,
+                  'phases': app.extensions['startup']}))
+'''
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """Nearest-rank percentiles in milliseconds."""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def rank(p: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 4)
+
+    return {
+        'min': round(ordered[0] * 1000, 4),
+        'p50': rank(50),
+        'p90': rank(90),
+        'p99': rank(99),
+        'max': round(ordered[-1] * 1000, 4),
+        'mean': round(sum(ordered) / len(ordered) * 1000, 4)
+    }
+
+
+def peak_memory(run: Callable[[], object]) -> int:
+    """Peak bytes allocated by Python while run() executes."""
+    tracemalloc.start()
+    try:
+        run()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def time_runs(run: Callable[[], int], repeat: int) -> Dict:
+    """Time repeat calls of run(), which returns the nodes it visited."""
+    latencies = []
+    nodes = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        nodes += run()
+        latencies.append(time.perf_counter() - start)
+    elapsed = sum(latencies)
+    return {
+        'runs': repeat,
+        'nodes_per_run': nodes // repeat,
+        'nodes_per_sec': round(nodes / elapsed) if elapsed else None,
+        'latency_ms': percentiles(latencies),
+        'peak_memory_bytes': peak_memory(run)
+    }
+
+
+def bench_engines(repeat: int, tree_depth: int, time_limit: Optional[float]) -> Dict:
+    results = {}
+    for name, engine in ENGINES.items():
+        results[name] = {}
+        for position, cells in CORPUS.items():
+            board = STANDARD.encode(cells)
+
+            def best_move(board: Bitboard = board) -> int:
+                # A fresh table per run, otherwise every run after the first is a lookup
+                ai = engine(STANDARD, TranspositionTable())
+                ai.live_search = True
+                return ai.get_best_move(board, time_limit)[1]
+
+            def tree(board: Bitboard = board) -> int:
+                ai = engine(STANDARD, TranspositionTable())
+                return ai.generate_tree(board, tree_depth)['nodesExplored']
+
+            results[name][position] = {
+                'get_best_move': time_runs(best_move, repeat),
+                'generate_tree': time_runs(tree, repeat)
+            }
+    return results
+
+
+def o_to_move_positions() -> List[Bitboard]:
+    """Every unfinished 3x3 position with O to move, one of each set of symmetric ones."""
+    spec = STANDARD
+    seen = set()
+    positions = []
+    stack = [(0, 0)]
+    while stack:
+        x, o = stack.pop()
+        key = spec.canonical(x, o)[0]
+        if key in seen or spec.is_win(x) or spec.is_win(o) or (x | o) == spec.full:
+            continue
+        seen.add(key)
+        x_to_move = x.bit_count() == o.bit_count()
+        if not x_to_move:
+            positions.append((x, o))
+        for pos in spec.moves(spec.full ^ (x | o)):
+            stack.append((x | 1 << pos, o) if x_to_move else (x, o | 1 << pos))
+    return sorted(positions)
+
+
+def sign(value: int) -> int:
+    return (value > 0) - (value < 0)
+
+
+def bench_depth_limited(depths: Sequence[int], weights: Tuple[int, ...]) -> Dict:
+    """Move quality and latency of each search depth next to full search.
+
+    A move is optimal when the solved table has it among the best, and a
+    blunder when it changes the position's result: a win not kept, or a
+    draw lost.
+    """
+    solved = get_solved_table() or load_solved_table()
+    positions = o_to_move_positions()
+    results = {}
+    for name, engine in ENGINES.items():
+        results[name] = {}
+        # Engines without an evaluator (MCTS) have no depth limit to compare
+        for depth in (None,) + (tuple(depths) if hasattr(engine, 'set_weights') else ()):
+            latencies = []
+            nodes = optimal = blunders = 0
+            for board in positions:
+                ai = engine(STANDARD, TranspositionTable())
+                ai.live_search = True
+                if hasattr(ai, 'set_weights'):
+                    ai.search_depth = depth
+                    ai.set_weights(weights)
+                start = time.perf_counter()
+                move, explored = ai.get_best_move(board)
+                latencies.append(time.perf_counter() - start)
+                nodes += explored
+                value, best_moves = solved.lookup(board)
+                if best_moves >> move & 1:
+                    optimal += 1
+                if sign(solved.lookup((board[0], board[1] | 1 << move))[0]) < sign(value):
+                    blunders += 1
+            results[name]['full' if depth is None else 'depth_%d' % depth] = {
+                'positions': len(positions),
+                'optimal_moves': round(optimal / len(positions), 4),
+                'blunders': blunders,
+                'nodes_per_move': round(nodes / len(positions), 1),
+                'latency_ms': percentiles(latencies)
+            }
+    return {'weights': list(weights), 'engines': results}
+
+
+def play_game(client, algorithm: str, tree_depth: int) -> List[Tuple[str, float, int]]:
+    """One scripted game against the AI, returning (route, seconds, status) per request."""
+    timings = []
+
+    def post(route: str, payload: Optional[Dict] = None):
+        start = time.perf_counter()
+        response = client.post(route, json=payload if payload is not None else {})
+        timings.append((route, time.perf_counter() - start, response.status_code))
+        return response
+
+    state = post('/reset').get_json()
+    for position in LOAD_TEST_MOVES:
+        if state.get('game_over'):
+            break
+        if state['board'][position]:
+            continue
+        state = post('/make_move', {'position': position, 'algorithm': algorithm, 'live_search': True}).get_json()
+        post('/get_tree', {'board': state['board'], 'algorithm': algorithm, 'depth': tree_depth})
+    return timings
+
+
+def bench_http(concurrency: int, games: int, algorithm: str, tree_depth: int) -> Dict:
+    from app import create_app
+    app = create_app()
+
+    def player(_: int) -> List[Tuple[str, float, int]]:
+        with app.test_client() as client:
+            return play_game(client, algorithm, tree_depth)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        timings = [timing for game in pool.map(player, range(games)) for timing in game]
+    elapsed = time.perf_counter() - start
+
+    routes = {}
+    for route in sorted({route for route, _, _ in timings}):
+        samples = [seconds for r, seconds, _ in timings if r == route]
+        routes[route] = {
+            'requests': len(samples),
+            'errors': sum(1 for r, _, status in timings if r == route and status >= 400),
+            'latency_ms': percentiles(samples)
+        }
+    return {
+        'concurrency': concurrency,
+        'games': games,
+        'algorithm': algorithm,
+        'requests': len(timings),
+        'seconds': round(elapsed, 4),
+        'requests_per_sec': round(len(timings) / elapsed, 2) if elapsed else None,
+        'routes': routes
+    }
+
+
+def bench_cold_start(runs: int) -> Dict:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    timings = {'process': [], 'import': [], 'create_app': [], 'first_move': []}
+    phases = {}
+    for _ in range(runs):
+        start = time.perf_counter()
+        output = subprocess.run([sys.executable, '-c', COLD_START], cwd=root, capture_output=True, text=True,
+                                check=True).stdout
+        # Interpreter launch to exit, the rest is measured inside
+        timings['process'].append(time.perf_counter() - start)
+        result = json.loads(output.splitlines()[-1])
+        for key in ('import', 'create_app', 'first_move'):
+            timings[key].append(result[key])
+        for phase, seconds in result['phases'].items():
+            phases.setdefault(phase, []).append(seconds)
+    return {
+        'runs': runs,
+        'latency_ms': {key: percentiles(samples) for key, samples in timings.items()},
+        'phases_ms': {phase: percentiles(samples) for phase, samples in phases.items()}
+    }
+
+
+def run(repeat: int = 10, tree_depth: int = 3, time_limit: Optional[float] = None,
+        concurrency: int = 4, games: int = 20, algorithm: str = 'alphabeta', cold_starts: int = 5,
+        depths: Sequence[int] = (1, 2, 3, 4), weights: Tuple[int, ...] = DEFAULT_WEIGHTS) -> Dict:
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'config': {
+            'repeat': repeat,
+            'tree_depth': tree_depth,
+            'time_limit': time_limit,
+            'concurrency': concurrency,
+            'games': games,
+            'algorithm': algorithm,
+            'cold_starts': cold_starts,
+            'depths': list(depths)
+        },
+        'engines': bench_engines(repeat, tree_depth, time_limit),
+        'depth_limited': bench_depth_limited(depths, weights) if depths else None,
+        'http': bench_http(concurrency, games, algorithm, tree_depth) if games else None,
+        'cold_start': bench_cold_start(cold_starts) if cold_starts else None
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Benchmark the search engines and HTTP endpoints.')
+    parser.add_argument('--repeat', type=int, default=10, help='timed runs per engine and position')
+    parser.add_argument('--tree-depth', type=int, default=3, help='depth of generated trees')
+    parser.add_argument('--time-limit', type=float, default=None,
+                        help='seconds per get_best_move, searches to the end of the game if omitted')
+    parser.add_argument('--concurrency', type=int, default=4, help='simultaneous players in the load test')
+    parser.add_argument('--games', type=int, default=20, help='games played in the load test, 0 to skip it')
+    parser.add_argument('--algorithm', choices=sorted(ENGINES), default='alphabeta',
+                        help='AI used in the load test')
+    parser.add_argument('--depths', default='1,2,3,4',
+                        help='search depths compared with full search, comma separated, empty to skip')
+    parser.add_argument('--weights', default=','.join(map(str, DEFAULT_WEIGHTS)),
+                        help='evaluator weights for the depth comparison, see app.evaluation')
+    parser.add_argument('--cold-starts', type=int, default=5,
+                        help='app cold starts to time, each in a new interpreter, 0 to skip them')
+    parser.add_argument('--output', help='write the JSON results here instead of stdout')
+    args = parser.parse_args(argv)
+    try:
+        depths = [int(depth) for depth in args.depths.split(',') if depth]
+        weights = parse_weights(args.weights)
+    except ValueError as e:
+        parser.error(str(e))
+
+    results = run(args.repeat, args.tree_depth, args.time_limit, args.concurrency, args.games, args.algorithm,
+                  args.cold_starts, depths, weights)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+        print('Wrote %s' % args.output)
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
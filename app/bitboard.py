@@ -0,0 +1,192 @@
+from functools import lru_cache
+from typing import List, Tuple
+
+# A position is a pair of integers (X cells, O cells); bit i is cell i of the
+# row-major board. The list-of-strings form only exists at the JSON boundary,
+# see encode()/decode().
+Bitboard = Tuple[int, int]
+
+EMPTY_BOARD: Bitboard = (0, 0)
+
+MAX_SIDE = 7
+# Cell sets up to this size get full lookup tables for wins and moves
+TABLE_BITS = 9
+CHUNK_MASK = (1 << TABLE_BITS) - 1
+
+
+def player_to_move(board: Bitboard) -> str:
+    """X moves first, so O is to move when X has more stones."""
+    return 'X' if board[0].bit_count() <= board[1].bit_count() else 'O'
+
+
+def iter_cells(bits: int) -> Tuple[int, ...]:
+    cells = []
+    while bits:
+        low = bits & -bits
+        cells.append(low.bit_length() - 1)
+        bits ^= low
+    return tuple(cells)
+
+
+class BoardSpec:
+    """An m,n,k board: rows x cols cells, k in a row wins."""
+
+    def __init__(self, rows: int = 3, cols: int = 3, k: int = 3):
+        if not 1 <= rows <= MAX_SIDE or not 1 <= cols <= MAX_SIDE:
+            raise ValueError('Board sides must be between 1 and %d' % MAX_SIDE)
+        if not 1 <= k <= max(rows, cols):
+            raise ValueError('k must be between 1 and the longest board side')
+
+        self.rows = rows
+        self.cols = cols
+        self.k = k
+        self.dims = (rows, cols, k)
+        self.cells = rows * cols
+        self.full = (1 << self.cells) - 1
+        # Wins score win_score - plies so faster wins are preferred
+        self.win_score = self.cells + 1
+
+        self.lines = self.generate_lines()
+        self.win_masks = [sum(1 << i for i in line) for line in self.lines]
+        self.symmetries = self.generate_symmetries()
+
+        # is_win(bits) and moves(empty) are called at every search node, so
+        # small boards bind them straight to a table lookup
+        if self.cells <= TABLE_BITS:
+            self.winning = [self.has_line(bits) for bits in range(self.full + 1)]
+            self.moves_table = [iter_cells(bits) for bits in range(self.full + 1)]
+            self.is_win = self.winning.__getitem__
+            self.moves = self.moves_table.__getitem__
+        else:
+            self.winning = None
+            self.moves_table = None
+            self.is_win = self.has_line
+            self.moves = iter_cells
+
+        # Symmetries are applied TABLE_BITS cells at a time through lookup
+        # tables, transform_tables[t][chunk][bits] is the transformed chunk.
+        self.transform_tables = []
+        for perm in self.symmetries:
+            target = [0] * self.cells
+            for i, source in enumerate(perm):
+                target[source] = 1 << i
+            self.transform_tables.append([
+                [sum(target[start + i] for i in range(min(TABLE_BITS, self.cells - start)) if bits >> i & 1)
+                 for bits in range(1 << TABLE_BITS)]
+                for start in range(0, self.cells, TABLE_BITS)
+            ])
+
+    def __repr__(self) -> str:
+        return 'BoardSpec(%d, %d, %d)' % self.dims
+
+    def generate_lines(self) -> List[List[int]]:
+        lines = []
+        for r in range(self.rows):
+            for c in range(self.cols):
+                for dr, dc in ((0, 1), (1, 0), (1, 1), (1, -1)):  # row, column, diagonals
+                    end_r = r + dr * (self.k - 1)
+                    end_c = c + dc * (self.k - 1)
+                    if 0 <= end_r < self.rows and 0 <= end_c < self.cols:
+                        lines.append([(r + dr * i) * self.cols + c + dc * i for i in range(self.k)])
+                        if self.k == 1:
+                            break
+        return lines
+
+    def generate_symmetries(self) -> List[List[int]]:
+        # perm[i] is the cell of the original board that lands on cell i
+        n, m = self.rows - 1, self.cols - 1
+        sources = [
+            lambda r, c: (r, c),  # identity
+            lambda r, c: (n - r, m - c),  # rotate 180
+            lambda r, c: (r, m - c),  # mirror columns
+            lambda r, c: (n - r, c)  # mirror rows
+        ]
+        if self.rows == self.cols:
+            sources = [
+                lambda r, c: (r, c),  # identity
+                lambda r, c: (n - c, r),  # rotate 90
+                lambda r, c: (n - r, n - c),  # rotate 180
+                lambda r, c: (c, n - r),  # rotate 270
+                lambda r, c: (r, n - c),  # mirror columns
+                lambda r, c: (n - r, c),  # mirror rows
+                lambda r, c: (c, r),  # main diagonal
+                lambda r, c: (n - c, n - r)  # anti diagonal
+            ]
+        perms = []
+        for source in sources:
+            perm = []
+            for i in range(self.cells):
+                r, c = source(i // self.cols, i % self.cols)
+                perm.append(r * self.cols + c)
+            perms.append(perm)
+        return perms
+
+    def has_line(self, bits: int) -> bool:
+        for mask in self.win_masks:
+            if bits & mask == mask:
+                return True
+        return False
+
+    def transform(self, bits: int, t: int) -> int:
+        result = 0
+        for table in self.transform_tables[t]:
+            result |= table[bits & CHUNK_MASK]
+            bits >>= TABLE_BITS
+        return result
+
+    def canonical(self, x: int, o: int) -> Tuple[int, int]:
+        """Return the smallest encoding over all symmetries and the transform that produced it."""
+        best_key = None
+        best_transform = 0
+        single_chunk = self.cells <= TABLE_BITS
+        for t, tables in enumerate(self.transform_tables):
+            if single_chunk:
+                key = tables[0][x] | tables[0][o] << self.cells
+            else:
+                key = self.transform(x, t) | self.transform(o, t) << self.cells
+            if best_key is None or key < best_key:
+                best_key = key
+                best_transform = t
+        return best_key, best_transform
+
+    def encode(self, cells: List[str]) -> Bitboard:
+        if not isinstance(cells, list) or len(cells) != self.cells:
+            raise ValueError('Board must be a list of %d cells' % self.cells)
+        x = o = 0
+        for i, cell in enumerate(cells):
+            if cell == 'X':
+                x |= 1 << i
+            elif cell == 'O':
+                o |= 1 << i
+            elif cell != '':
+                raise ValueError('Invalid cell value: %r' % (cell,))
+        return x, o
+
+    def decode(self, board: Bitboard) -> List[str]:
+        x, o = board
+        return ['X' if x >> i & 1 else 'O' if o >> i & 1 else '' for i in range(self.cells)]
+
+
+@lru_cache(maxsize=None)
+def board_spec(rows: int = 3, cols: int = 3, k: int = 3) -> BoardSpec:
+    """Shared BoardSpec instance for the given dimensions."""
+    return BoardSpec(rows, cols, k)
+
+
+STANDARD = board_spec(3, 3, 3)
+
+# Plain 3x3 tables, used by code that only ever deals with the standard game
+CELLS = STANDARD.cells
+FULL = STANDARD.full
+WIN_MASKS = STANDARD.win_masks
+SYMMETRIES = STANDARD.symmetries
+WINNING = STANDARD.winning
+MOVES = STANDARD.moves_table
+
+
+def encode(cells: List[str]) -> Bitboard:
+    return STANDARD.encode(cells)
+
+
+def decode(board: Bitboard) -> List[str]:
+    return STANDARD.decode(board)
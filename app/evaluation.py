@@ -0,0 +1,120 @@
+# Static evaluation of the positions a depth-limited search stops at. A line
+# still open to one side only is worth a weight to that side, by how many
+# more stones the side needs to complete it: weights[0] when one more wins
+# it, weights[1] when two more do, and the last weight for anything further.
+# Lines both sides hold, or neither does, are worth nothing. The default
+# weights are the engines' original heuristic: 3 one move from completion,
+# 1 otherwise.
+#
+# Every line's contents are one code, o * (k + 1) + x for o and x stones in
+# it, so a line's value is one lookup in line_scores. LineCounters keeps the
+# codes of a position while the search plays through it: a move updates the
+# score from the lines through its cell only, so a leaf costs nothing to
+# score instead of a pass over every line of the board.
+
+from functools import lru_cache
+from typing import List, Sequence, Tuple
+from app.bitboard import Bitboard, BoardSpec
+
+DEFAULT_WEIGHTS: Tuple[int, ...] = (3, 1)
+
+
+def parse_weights(weights: Sequence) -> Tuple[int, ...]:
+    """Weights as a tuple, raising ValueError unless they are integers from 0 up."""
+    if isinstance(weights, str):
+        weights = weights.split(',')
+    try:
+        parsed = tuple(int(weight) for weight in weights)
+    except (TypeError, ValueError):
+        raise ValueError('Evaluator weights must be integers')
+    if not parsed or min(parsed) < 0:
+        raise ValueError('Evaluator weights must be one or more integers from 0 up')
+    return parsed
+
+
+class Evaluator:
+    """Heuristic scores for O of one board size under one set of weights."""
+
+    def __init__(self, spec: BoardSpec, weights: Tuple[int, ...] = DEFAULT_WEIGHTS):
+        self.spec = spec
+        self.weights = weights
+        k = spec.k
+        self.step = k + 1  # Code added by an O stone, an X stone adds 1
+        # Value of a line holding count stones of one side only, a full line is a win instead
+        self.line_values = [0] + [weights[min(k - count - 1, len(weights) - 1)] for count in range(1, k)] + [0]
+        self.line_scores = [0] * (self.step * self.step)
+        for o in range(k + 1):
+            for x in range(k + 1):
+                if o and not x:
+                    self.line_scores[o * self.step + x] = self.line_values[o]
+                elif x and not o:
+                    self.line_scores[o * self.step + x] = -self.line_values[x]
+        # Change in a line's value when O or X adds a stone to it, by its code before
+        size = len(self.line_scores)
+        self.o_gains = [self.line_scores[code + self.step] - self.line_scores[code] if code + self.step < size else 0
+                        for code in range(size)]
+        self.x_gains = [self.line_scores[code + 1] - self.line_scores[code] if code + 1 < size else 0
+                        for code in range(size)]
+        self.cell_lines = tuple(tuple(i for i, line in enumerate(spec.lines) if cell in line)
+                                for cell in range(spec.cells))
+        # Heuristic scores divided by this fall in (-1, 1), below any win or loss
+        self.scale = max(weights) * len(spec.lines) + 1
+
+    def line_codes(self, board: Bitboard) -> List[int]:
+        x, o = board
+        return [(o & mask).bit_count() * self.step + (x & mask).bit_count() for mask in self.spec.win_masks]
+
+    def heuristic(self, board: Bitboard) -> int:
+        """The weighted sum of the lines, without looking for a win."""
+        line_scores = self.line_scores
+        return sum(line_scores[code] for code in self.line_codes(board))
+
+    def evaluate(self, board: Bitboard) -> int:
+        """win_score for an O win, -win_score for an X win, 0 for a full board, else the heuristic."""
+        x, o = board
+        spec = self.spec
+        if spec.is_win(o):
+            return spec.win_score
+        if spec.is_win(x):
+            return -spec.win_score
+        if not spec.full ^ (x | o):
+            return 0
+        return self.heuristic(board)
+
+    def counters(self, board: Bitboard) -> 'LineCounters':
+        return LineCounters(self, board)
+
+
+class LineCounters:
+    """The line codes and heuristic of a position, updated move by move."""
+
+    __slots__ = ('codes', 'score', 'cell_lines', 'step', 'o_gains', 'x_gains')
+
+    def __init__(self, evaluator: Evaluator, board: Bitboard):
+        self.codes = evaluator.line_codes(board)
+        self.score = sum(evaluator.line_scores[code] for code in self.codes)
+        self.cell_lines = evaluator.cell_lines
+        self.step = evaluator.step
+        self.o_gains = evaluator.o_gains
+        self.x_gains = evaluator.x_gains
+
+    def play(self, cell: int, is_o: bool) -> None:
+        codes = self.codes
+        gains, step = (self.o_gains, self.step) if is_o else (self.x_gains, 1)
+        for line in self.cell_lines[cell]:
+            code = codes[line]
+            self.score += gains[code]
+            codes[line] = code + step
+
+    def undo(self, cell: int, is_o: bool) -> None:
+        codes = self.codes
+        gains, step = (self.o_gains, self.step) if is_o else (self.x_gains, 1)
+        for line in self.cell_lines[cell]:
+            code = codes[line] - step
+            codes[line] = code
+            self.score -= gains[code]
+
+
+@lru_cache(maxsize=None)
+def evaluator(spec: BoardSpec, weights: Tuple[int, ...] = DEFAULT_WEIGHTS) -> Evaluator:
+    return Evaluator(spec, weights)
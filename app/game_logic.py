@@ -1,40 +1,143 @@
+import secrets
+import time
+from app.bitboard import EMPTY_BOARD, STANDARD
 from app.minmax import TicTacToeAI
 from app.alphabeta import AlphaBetaAI
+from app.mcts import DEFAULT_ITERATIONS, MCTSAI
+from app.evaluation import DEFAULT_WEIGHTS
+from app.metrics import run_search
+from app.search_memory import retain_search
+
+# Plain minimax has no depth limit, so it is only offered on small boards
+MAX_MINMAX_CELLS = 9
+
+ENGINES = {
+    'minmax': TicTacToeAI,
+    'alphabeta': AlphaBetaAI,
+    'mcts': MCTSAI
+}
 
 class TicTacToeGame:
-    def __init__(self):
-        self.board = [''] * 9
-        self.minmax_ai = TicTacToeAI()
-        self.alphabeta_ai = AlphaBetaAI()
-        self.current_ai = self.minmax_ai  # Default to MinMax
+    def __init__(self, spec=STANDARD):
+        self.spec = spec
+        # Engines by algorithm, built the first time the game needs one. An
+        # engine keeps the stats and cancel flag of its search, so each game
+        # has its own, but they outlive resets on the same board.
+        self.engines = {}
+        self.eval_weights = DEFAULT_WEIGHTS
+        self.mcts_iterations = DEFAULT_ITERATIONS
+        self.reset_game(spec)
+
+    def reset_game(self, spec=STANDARD):
+        """Clear the board for a new game, which starts a new record"""
+        if spec.dims != self.spec.dims:
+            self.spec = spec
+            self.engines = {}
+        self.board = EMPTY_BOARD
+        self.set_live_search(False)
+        self.set_search_workers(0)
+        self.set_search_depth(None)
         self.current_player = 'X'  # Human starts
         self.game_over = False
         self.winner = None
+        self.last_search = None  # What the search for the AI's last move found, reused by the next
+        # Cells in the order they were played, X first. Every reset starts a new record.
+        self.moves = []
+        self.record_id = secrets.token_hex(8)
+        self.started_at = time.time()
         self.ai_stats = {
             'nodes_explored': 0,
-            'algorithm': 'minmax'
+            'table_hits': 0,
+            'solved_lookup': False,
+            'search_depth': 0,
+            'cutoffs': 0,
+            'first_move_cutoffs': 0,
+            'search': None,
+            'reused_search': False,
+            'principal_variation': [],
+            'profile_id': None,
+            'depth_limit': None,
+            'algorithm': 'minmax'  # Default to MinMax
         }
 
+    def engine(self, algorithm):
+        engine = self.engines.get(algorithm)
+        if engine is None:
+            engine = self.engines[algorithm] = self.configure(ENGINES[algorithm](self.spec))
+        return engine
+
+    def configure(self, engine):
+        engine.live_search = self.live_search
+        engine.workers = self.search_workers
+        if isinstance(engine, MCTSAI):
+            # Playouts run to the end of the game, there is no horizon to evaluate
+            engine.iterations = self.mcts_iterations
+        else:
+            engine.search_depth = self.search_depth
+            engine.set_weights(self.eval_weights)
+        return engine
+
+    @property
+    def current_ai(self):
+        return self.engine(self.ai_stats['algorithm'])
+
     def set_algorithm(self, algorithm):
-        if algorithm == 'alphabeta':
-            self.current_ai = self.alphabeta_ai
-            self.ai_stats['algorithm'] = 'alphabeta'
+        if algorithm in ('alphabeta', 'mcts'):
+            self.ai_stats['algorithm'] = algorithm
         else:
-            self.current_ai = self.minmax_ai
+            if self.spec.cells > MAX_MINMAX_CELLS:
+                raise ValueError('MinMax only supports boards up to %d cells, use alphabeta' % MAX_MINMAX_CELLS)
             self.ai_stats['algorithm'] = 'minmax'
 
+    def set_live_search(self, enabled):
+        self.live_search = enabled
+        for engine in self.engines.values():
+            engine.live_search = enabled
+
+    def set_search_workers(self, workers):
+        self.search_workers = workers
+        for engine in self.engines.values():
+            engine.workers = workers
+
+    def set_search_depth(self, depth):
+        """Plies the AI searches before scoring positions with the evaluator, None for no limit"""
+        self.search_depth = depth
+        for engine in self.engines.values():
+            if not isinstance(engine, MCTSAI):
+                engine.search_depth = depth
+
+    def set_eval_weights(self, weights):
+        self.eval_weights = weights
+        for engine in self.engines.values():
+            if not isinstance(engine, MCTSAI):
+                engine.set_weights(weights)
+
+    def set_mcts_iterations(self, iterations):
+        """Iterations the MCTS engine runs per search, unless its time limit comes first"""
+        self.mcts_iterations = iterations
+        for engine in self.engines.values():
+            if isinstance(engine, MCTSAI):
+                engine.iterations = iterations
+
     def make_move(self, position):
-        if self.game_over or position < 0 or position > 8 or self.board[position]:
+        if self.game_over or position < 0 or position >= self.spec.cells:
+            return False
+        x, o = self.board
+        if (x | o) >> position & 1:
             return False
 
-        self.board[position] = self.current_player
+        if self.current_player == 'X':
+            self.board = (x | 1 << position, o)
+        else:
+            self.board = (x, o | 1 << position)
+        self.moves.append(position)
         
         if self.check_winner(self.current_player):
             self.game_over = True
             self.winner = self.current_player
             return True
 
-        if '' not in self.board:
+        if (self.board[0] | self.board[1]) == self.spec.full:
             self.game_over = True
             self.winner = 'Tie'
             return True
@@ -42,26 +145,54 @@ class TicTacToeGame:
         self.current_player = 'O'
         return True
 
-    def ai_move(self):
+    def ai_move(self, time_limit=None, profile=False):
         if self.game_over:
             return False
+        board = self.board
+        ai = self.current_ai
+        algorithm = self.ai_stats['algorithm']
+        move_info, profile_id = self.search_ai_move(ai, algorithm, board, self.last_search, time_limit, profile)
+        return self.apply_ai_move(ai, algorithm, board, move_info, profile_id)
 
-        # Unpack the tuple correctly
-        move_info = self.current_ai.get_best_move(self.board)
+    def search_ai_move(self, ai, algorithm, board, previous, time_limit=None, profile=False):
+        """ai's move from board and the ID of its profile. Nothing of the game is
+        touched, so with a detached engine it runs without the game's lock"""
+        return run_search(lambda: ai.get_best_move(board, time_limit, previous=previous),
+                          ai, algorithm, 'move', profile)
+
+    def apply_ai_move(self, ai, algorithm, board, move_info, profile_id=None):
+        """Record ai's search from board and play its move, unless the game moved on meanwhile"""
+        if self.game_over or self.board != board:
+            return False
+        self.ai_stats['profile_id'] = profile_id
         if isinstance(move_info, tuple):
             ai_position, nodes_explored = move_info
             self.ai_stats['nodes_explored'] = nodes_explored
         else:
             ai_position = move_info
             self.ai_stats['nodes_explored'] = 0
+        self.ai_stats['table_hits'] = ai.table_hits
+        self.ai_stats['solved_lookup'] = ai.solved_lookup
+        self.ai_stats['search_depth'] = ai.completed_depth
+        self.ai_stats['cutoffs'] = ai.cutoffs
+        self.ai_stats['first_move_cutoffs'] = ai.first_move_cutoffs
+        self.ai_stats['search'] = ai.stats.to_dict()
+        self.ai_stats['depth_limit'] = ai.search_depth
+        self.last_search = retain_search(ai, board, ai_position)
+        self.ai_stats['reused_search'] = ai.reused_search
+        self.ai_stats['principal_variation'] = self.last_search.pv if self.last_search is not None else []
+        ai.stats.log(algorithm=algorithm, solved_lookup=ai.solved_lookup,
+                     cells=self.spec.cells)
 
         if ai_position is not None:
-            self.board[ai_position] = 'O'
+            x, o = self.board
+            self.board = (x, o | 1 << ai_position)
+            self.moves.append(ai_position)
             
             if self.check_winner('O'):
                 self.game_over = True
                 self.winner = 'O'
-            elif '' not in self.board:
+            elif (x | self.board[1]) == self.spec.full:
                 self.game_over = True
                 self.winner = 'Tie'
             
@@ -70,20 +201,36 @@ class TicTacToeGame:
         return False
 
     def check_winner(self, player):
-        return self.current_ai.is_winner(self.board, player)
+        return self.spec.is_win(self.board[0] if player == 'X' else self.board[1])
 
     def get_game_state(self):
         return {
-            'board': self.board,
+            'board': self.spec.decode(self.board),
+            'rows': self.spec.rows,
+            'cols': self.spec.cols,
+            'k': self.spec.k,
             'current_player': self.current_player,
             'game_over': self.game_over,
             'winner': self.winner,
             'ai_stats': self.ai_stats
         }
 
-    def generate_tree(self, board, depth):
+    def generate_tree(self, board, depth, max_nodes=None):
         """Generate tree using current AI algorithm"""
-        return self.current_ai.generate_tree(board, depth)
+        return self.current_ai.generate_tree(board, depth, max_nodes=max_nodes)
+
+    def build_tree(self, board, depth, max_nodes=None, profile=False):
+        """Generate tree using current AI algorithm, as a CompactTree and the ID of its profile"""
+        ai = self.current_ai
+        return run_search(lambda: ai.build_tree(board, depth, max_nodes=max_nodes),
+                          ai, self.ai_stats['algorithm'], 'tree', profile)
+
+    def tree_settings(self):
+        """What the current engine's trees depend on besides the board and the limits"""
+        if self.ai_stats['algorithm'] == 'mcts':
+            return self.mcts_iterations
+        return self.eval_weights
 
-    def reset_game(self):
-        self.__init__()
\ No newline at end of file
+    def detached_engine(self):
+        """A fresh engine of the current kind, so trees can be streamed and moves searched without holding the game"""
+        return self.configure(ENGINES[self.ai_stats['algorithm']](self.spec))
\ No newline at end of file
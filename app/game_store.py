@@ -0,0 +1,114 @@
+import secrets
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Optional
+from app.bitboard import BoardSpec, STANDARD
+from app.game_logic import TicTacToeGame
+from app.persistence import GameRepository, game_snapshot, restore_game
+
+
+class GameSession:
+    def __init__(self, game_id: str, game: TicTacToeGame):
+        self.game_id = game_id
+        self.game = game
+        # Serialises requests that touch this game, the game itself is not thread-safe
+        self.lock = Lock()
+        self.last_used = time.monotonic()
+
+
+class GameStore:
+    """Live games of this process, keyed by game ID.
+
+    Games idle for longer than idle_timeout seconds are dropped, and once
+    max_games are live the least recently used one makes room for a new game.
+    Dropped games can come back from the repository, see persistence.
+    """
+
+    def __init__(self, max_games: int = 10000, idle_timeout: float = 1800.0,
+                 repository: Optional[GameRepository] = None):
+        self.max_games = max_games
+        self.idle_timeout = idle_timeout
+        self.repository = repository if repository is not None else GameRepository()
+        self.sessions = OrderedDict()  # least recently used first
+        self.lock = Lock()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        self.restored = 0
+
+    def __len__(self) -> int:
+        return len(self.sessions)
+
+    def get(self, game_id: str) -> Optional[GameSession]:
+        now = time.monotonic()
+        with self.lock:
+            self.expire_idle(now)
+            game_session = self.sessions.get(game_id)
+            if game_session is not None:
+                game_session.last_used = now
+                self.sessions.move_to_end(game_id)
+                return game_session
+        return self.restore(game_id)
+
+    def restore(self, game_id: str) -> Optional[GameSession]:
+        # Read outside the lock, other games need not wait for the repository
+        snapshot = self.repository.load(game_id)
+        if snapshot is None:
+            return None
+        game_session = GameSession(game_id, restore_game(snapshot))
+        with self.lock:
+            # Another request may have restored it meanwhile
+            if game_id in self.sessions:
+                return self.sessions[game_id]
+            while len(self.sessions) >= self.max_games:
+                self.sessions.popitem(last=False)
+                self.evicted += 1
+            self.sessions[game_id] = game_session
+            self.restored += 1
+        return game_session
+
+    def save(self, game_session: GameSession) -> None:
+        """Hand the game's current state to the repository. Callers hold the game's lock."""
+        self.repository.save(game_snapshot(game_session.game_id, game_session.game))
+
+    def create(self, spec: BoardSpec = STANDARD) -> GameSession:
+        game_session = GameSession(secrets.token_urlsafe(12), TicTacToeGame(spec))
+        with self.lock:
+            self.expire_idle(game_session.last_used)
+            while len(self.sessions) >= self.max_games:
+                self.sessions.popitem(last=False)
+                self.evicted += 1
+            self.sessions[game_session.game_id] = game_session
+            self.created += 1
+        return game_session
+
+    def get_or_create(self, game_id: Optional[str]) -> GameSession:
+        game_session = self.get(game_id) if game_id else None
+        return game_session if game_session is not None else self.create()
+
+    def remove(self, game_id: str) -> None:
+        with self.lock:
+            self.sessions.pop(game_id, None)
+
+    def expire_idle(self, now: float) -> None:
+        # Callers hold self.lock. Sessions are kept in last-used order, so
+        # only the front of the dict ever needs checking.
+        cutoff = now - self.idle_timeout
+        while self.sessions:
+            game_session = next(iter(self.sessions.values()))
+            if game_session.last_used > cutoff:
+                break
+            self.sessions.popitem(last=False)
+            self.expired += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'live_games': len(self.sessions),
+                'max_games': self.max_games,
+                'created': self.created,
+                'expired': self.expired,
+                'evicted': self.evicted,
+                'restored': self.restored
+            }
@@ -0,0 +1,168 @@
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+from typing import Callable, Dict, Optional
+from app.alphabeta import SearchTimeout
+from app.game_store import GameSession
+
+
+class JobQueueFull(Exception):
+    """Raised when too many AI moves are already waiting to run."""
+
+
+class AIJob:
+    def __init__(self, job_id: str, game_id: str):
+        self.job_id = job_id
+        self.game_id = game_id
+        self.status = 'queued'  # then running, and finally done, cancelled or failed
+        self.result = None  # Game state after the AI moved
+        self.error = None
+        self.cancelled = False
+        self.engine = None  # Engine searching, so a cancel can stop it
+        self.future = None
+        self.finished = Event()
+        self.finished_at = None
+
+    def to_dict(self) -> Dict:
+        job = {
+            'job_id': self.job_id,
+            'game_id': self.game_id,
+            'status': self.status
+        }
+        if self.result is not None:
+            job['result'] = self.result
+        if self.error is not None:
+            job['error'] = self.error
+        return job
+
+
+class AIJobQueue:
+    """AI moves computed off the request thread.
+
+    At most max_workers searches run at once and at most max_pending jobs
+    may be queued or running. A game has at most one job in flight; asking
+    again returns that job. Finished jobs stay readable for retention seconds.
+    on_move is called with the game's session, under its lock, after the AI moved.
+    """
+
+    def __init__(self, max_workers: int = 4, max_pending: int = 64, retention: float = 300.0,
+                 on_move: Optional[Callable[[GameSession], None]] = None):
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='ai-move')
+        self.max_pending = max_pending
+        self.retention = retention
+        self.on_move = on_move
+        self.lock = Lock()
+        self.jobs: Dict[str, AIJob] = {}
+        self.in_flight: Dict[str, AIJob] = {}  # game ID -> its unfinished job
+        self.submitted = 0
+        self.rejected = 0
+        self.cancelled = 0
+
+    def get(self, job_id: str) -> Optional[AIJob]:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def in_flight_job(self, game_id: str) -> Optional[AIJob]:
+        with self.lock:
+            return self.in_flight.get(game_id)
+
+    def submit(self, game_session: GameSession, time_limit: Optional[float] = None,
+               profile: bool = False) -> AIJob:
+        with self.lock:
+            self.expire_finished(time.monotonic())
+            job = self.in_flight.get(game_session.game_id)
+            if job is not None:
+                return job
+            if len(self.in_flight) >= self.max_pending:
+                self.rejected += 1
+                raise JobQueueFull()
+            job = AIJob(secrets.token_urlsafe(12), game_session.game_id)
+            self.jobs[job.job_id] = job
+            self.in_flight[job.game_id] = job
+            self.submitted += 1
+        job.future = self.executor.submit(self.run, job, game_session, time_limit, profile)
+        return job
+
+    def run(self, job: AIJob, game_session: GameSession, time_limit: Optional[float], profile: bool = False) -> None:
+        # The game is locked to read the position and to play the move, not
+        # during the search, so other requests for the game are answered meanwhile
+        try:
+            with game_session.lock:
+                if job.cancelled:
+                    self.finish(job, 'cancelled')
+                    return
+                job.status = 'running'
+                game = game_session.game
+                board = game.board
+                previous = game.last_search
+                algorithm = game.ai_stats['algorithm']
+                ai = job.engine = game.detached_engine() if not game.game_over else None
+            if ai is not None:
+                try:
+                    move_info, profile_id = game.search_ai_move(ai, algorithm, board, previous, time_limit, profile)
+                except SearchTimeout:
+                    # Only a cancel stops a search without a time limit
+                    self.finish(job, 'cancelled')
+                    return
+                finally:
+                    job.engine = None
+            with game_session.lock:
+                if job.cancelled:
+                    self.finish(job, 'cancelled')
+                    return
+                if ai is not None:
+                    game.apply_ai_move(ai, algorithm, board, move_info, profile_id)
+                if self.on_move is not None:
+                    self.on_move(game_session)
+                job.result = game.get_game_state()
+                job.result['game_id'] = game_session.game_id
+            self.finish(job, 'done')
+        except Exception as e:
+            job.error = str(e)
+            self.finish(job, 'failed')
+
+    def finish(self, job: AIJob, status: str) -> None:
+        with self.lock:
+            job.status = status
+            job.finished_at = time.monotonic()
+            if self.in_flight.get(job.game_id) is job:
+                del self.in_flight[job.game_id]
+            if status == 'cancelled':
+                self.cancelled += 1
+        job.finished.set()
+
+    def cancel_game(self, game_id: str) -> None:
+        """Drop the game's pending AI move, stopping its search if it already started."""
+        with self.lock:
+            job = self.in_flight.get(game_id)
+        if job is None:
+            return
+        job.cancelled = True
+        if job.future is not None and job.future.cancel():
+            self.finish(job, 'cancelled')
+            return
+        engine = job.engine
+        if engine is not None and hasattr(engine, 'cancel'):
+            engine.cancel()
+
+    def wait(self, job: AIJob, timeout: float) -> AIJob:
+        job.finished.wait(timeout)
+        return job
+
+    def expire_finished(self, now: float) -> None:
+        # Callers hold self.lock
+        cutoff = now - self.retention
+        for job_id in [job_id for job_id, job in self.jobs.items()
+                       if job.finished_at is not None and job.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    def stats(self) -> Dict:
+        with self.lock:
+            return {
+                'in_flight': len(self.in_flight),
+                'max_pending': self.max_pending,
+                'submitted': self.submitted,
+                'rejected': self.rejected,
+                'cancelled': self.cancelled
+            }
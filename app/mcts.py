@@ -0,0 +1,387 @@
+# Monte Carlo tree search (UCT). Every iteration walks down the tree by the
+# UCB1 rule, adds one child below the node it stops at, plays the game out
+# from there with random moves and adds the result to every node on the way
+# back up. The move played is the root child visited most.
+#
+# Nodes keep their untried moves as a cell bitmask and their results from
+# the point of view of the side that played the move leading to them: 1 for
+# a win, 0.5 for a draw, 0 for a loss. Boards are not stored, they follow
+# from the moves on the path. Playouts run on the bitboards and only look at
+# the lines through the cell just played.
+#
+# The search is bounded by iterations and by the time limit, whichever runs
+# out first. The subtree below the move played is handed back to the game
+# (see retain()) and the next search grows on from the grandchild the human
+# moved to. With workers > 1 the root is searched in parallel: every worker
+# grows its own tree and their root children are added together.
+
+import math
+import random
+import time
+from typing import Callable, Dict, Generator, Iterator, List, Optional, Tuple
+from app import parallel
+from app.alphabeta import SearchTimeout
+from app.bitboard import Bitboard, BoardSpec, STANDARD, player_to_move
+from app.search_memory import RetainedSearch
+from app.search_stats import SearchStats
+from app.solver import get_solved_table
+from app.transposition import TranspositionTable
+from app.tree import ROOT_ID, EXPANDABLE, CompactTree, TreeNode, pack_board
+
+DEFAULT_ITERATIONS = 5000
+# UCB1 exploration constant
+EXPLORATION = math.sqrt(2)
+# How many iterations run between two looks at the clock
+DEADLINE_CHECK_INTERVAL = 64
+# Children visited fewer times are dropped from the subtree kept for the next move
+MIN_RETAINED_VISITS = 4
+
+
+class MCTSNode:
+    __slots__ = ('move', 'parent', 'children', 'untried', 'visits', 'value', 'result')
+
+    def __init__(self, move: int, parent: Optional['MCTSNode'], untried: int, result: Optional[float] = None):
+        self.move = move  # Move that led here from parent, -1 at the root
+        self.parent = parent
+        self.children: List['MCTSNode'] = []
+        self.untried = untried  # Cells not expanded into children yet
+        self.visits = 0
+        self.value = 0.0  # Sum of the results for the side that played move
+        self.result = result  # The game's result for that side if it ended here
+
+    def best_child(self) -> Optional['MCTSNode']:
+        return max(self.children, key=lambda child: child.visits, default=None)
+
+
+class MCTSAI:
+    # Searches of one position differ from run to run
+    stochastic = True
+
+    def __init__(self, spec: BoardSpec = STANDARD, table: Optional[TranspositionTable] = None,
+                 seed: Optional[int] = None):
+        # table is accepted for parity with the other engines, the tree is the memory
+        self.spec = spec
+        self.ai_player = 'O'
+        self.human_player = 'X'
+        self.nodes_explored = 0  # Tree nodes added by the last search
+        self.playouts = 0
+        self.table_hits = 0
+        self.live_search = False  # Skip the solved table and always search
+        self.solved_lookup = False
+        self.completed_depth = 0  # Deepest ply the last tree reached
+        self.best_score = None  # Expected result of the last move for O, from -1 to 1
+        self.reused_search = False  # The last search grew on from the previous move's tree
+        self.tree_truncated = False
+        # Never cuts off, kept for parity with AlphaBetaAI stats
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.stats = SearchStats(spec.cells)
+        self.iterations = DEFAULT_ITERATIONS
+        self.search_depth = None  # Playouts run to the end of the game, there is no depth limit
+        self.exploration = EXPLORATION
+        self.rng = random.Random(seed)
+        self.root: Optional[MCTSNode] = None  # Tree of the last get_best_move, until retain()
+        self.cancel_requested = False
+        # Asked with the clock whether the parent of a pool search gave up, see parallel.mcts_child
+        self.aborted: Optional[Callable[[], bool]] = None
+        # Root-parallel search when workers > 1 and the root has enough empty cells
+        self.workers = 0
+        self.parallel_min_empty = parallel.PARALLEL_MIN_EMPTY
+        # Win masks of the lines through each cell
+        self.cell_masks = [tuple(mask for mask, line in zip(spec.win_masks, spec.lines) if cell in line)
+                           for cell in range(spec.cells)]
+
+    def is_winner(self, board: Bitboard, player: str) -> bool:
+        return self.spec.is_win(board[0] if player == 'X' else board[1])
+
+    def get_empty_cells(self, board: Bitboard) -> List[int]:
+        return list(self.spec.moves(self.spec.full ^ (board[0] | board[1])))
+
+    def cancel(self) -> None:
+        """Stop the running search from another thread."""
+        self.cancel_requested = True
+
+    def wins(self, bits: int, cell: int) -> bool:
+        """Whether the side holding bits has a line through cell."""
+        if self.spec.winning is not None:
+            return self.spec.winning[bits]
+        for mask in self.cell_masks[cell]:
+            if bits & mask == mask:
+                return True
+        return False
+
+    def playout(self, x: int, o: int, o_to_move: bool) -> float:
+        """Result for O of random moves from a position until the game ends."""
+        cells = list(self.spec.moves(self.spec.full ^ (x | o)))
+        self.rng.shuffle(cells)
+        wins = self.wins
+        for cell in cells:
+            if o_to_move:
+                o |= 1 << cell
+                if wins(o, cell):
+                    return 1.0
+            else:
+                x |= 1 << cell
+                if wins(x, cell):
+                    return 0.0
+            o_to_move = not o_to_move
+        return 0.5
+
+    def select(self, node: MCTSNode) -> MCTSNode:
+        # UCB1: the child's mean result plus a bonus for being visited rarely
+        log_visits = math.log(node.visits)
+        exploration = self.exploration
+        best = None
+        best_bound = float('-inf')
+        for child in node.children:
+            bound = child.value / child.visits + exploration * math.sqrt(log_visits / child.visits)
+            if bound > best_bound:
+                best = child
+                best_bound = bound
+        return best
+
+    def iterate(self, root: MCTSNode, x: int, o: int, o_to_move: bool) -> None:
+        """One selection, expansion, playout and backup from root."""
+        spec = self.spec
+        node = root
+        ply = 0
+        while node.result is None and not node.untried and node.children:
+            node = self.select(node)
+            if o_to_move:
+                o |= 1 << node.move
+            else:
+                x |= 1 << node.move
+            o_to_move = not o_to_move
+            ply += 1
+
+        if node.result is None and node.untried:
+            moves = spec.moves(node.untried)
+            move = moves[self.rng.randrange(len(moves))]
+            node.untried ^= 1 << move
+            if o_to_move:
+                o |= 1 << move
+                won = self.wins(o, move)
+            else:
+                x |= 1 << move
+                won = self.wins(x, move)
+            empty = spec.full ^ (x | o)
+            result = 1.0 if won else 0.5 if not empty else None
+            child = MCTSNode(move, node, empty if result is None else 0, result)
+            if won:
+                # A side that can win on the spot has no other move worth searching
+                node.children = [child]
+                node.untried = 0
+            else:
+                node.children.append(child)
+            node = child
+            o_to_move = not o_to_move
+            ply += 1
+            self.nodes_explored += 1
+            self.stats.nodes_by_ply[ply] += 1
+            self.completed_depth = max(self.completed_depth, ply)
+
+        if node.result is not None:
+            result = node.result
+        else:
+            self.playouts += 1
+            o_result = self.playout(x, o, o_to_move)
+            # The side to move here did not play the move leading here
+            result = 1.0 - o_result if o_to_move else o_result
+
+        while node is not None:
+            node.visits += 1
+            node.value += result
+            result = 1.0 - result
+            node = node.parent
+
+    def new_root(self, board: Bitboard, o_to_move: bool) -> MCTSNode:
+        """A tree of one node for board, terminal if the game is already over."""
+        spec = self.spec
+        x, o = board
+        # The root's results are for the side that is not to move, as if it had just moved
+        mover, other = (x, o) if o_to_move else (o, x)
+        if spec.is_win(mover):
+            return MCTSNode(-1, None, 0, 1.0)
+        if spec.is_win(other):
+            return MCTSNode(-1, None, 0, 0.0)
+        empty = spec.full ^ (x | o)
+        return MCTSNode(-1, None, empty, None if empty else 0.5)
+
+    def search(self, board: Bitboard, o_to_move: bool, iterations: int, deadline: Optional[float] = None,
+               root: Optional[MCTSNode] = None) -> MCTSNode:
+        """Grow root, a new tree for board unless given, by iterations or until deadline.
+
+        The first iteration always runs, so the root has a move to play.
+        """
+        x, o = board
+        if root is None:
+            root = self.new_root(board, o_to_move)
+        for i in range(iterations):
+            if self.cancel_requested:
+                raise SearchTimeout()
+            if i and not i % DEADLINE_CHECK_INTERVAL and \
+                    (deadline is not None and time.perf_counter() > deadline or
+                     self.aborted is not None and self.aborted()):
+                break
+            self.iterate(root, x, o, o_to_move)
+        return root
+
+    def get_best_move(self, board: Bitboard, time_limit: Optional[float] = None,
+                      previous: Optional[RetainedSearch] = None) -> Tuple[Optional[int], int]:
+        """The most visited root move after iterations, or fewer if time_limit (seconds) runs out.
+
+        previous is the game's search for its last move. When board is one of
+        its positions the search grows on from the tree kept there.
+        """
+        self.nodes_explored = 0
+        self.playouts = 0
+        self.table_hits = 0
+        self.solved_lookup = False
+        self.completed_depth = 0
+        self.best_score = None
+        self.reused_search = False
+        self.root = None
+        self.stats.reset()
+        self.cancel_requested = False
+        x, o = board
+        empty = self.spec.full ^ (x | o)
+
+        if not empty or self.spec.is_win(x) or self.spec.is_win(o):
+            return None, self.nodes_explored
+
+        if not self.live_search and self.spec is STANDARD:
+            solved = get_solved_table()
+            answer = solved.best_move(board) if solved is not None else None
+            if answer is not None:
+                self.solved_lookup = True
+                move, value = answer
+                # The table's value is in plies, only its sign is a result
+                self.best_score = float((value > 0) - (value < 0))
+                return move, self.nodes_explored
+
+        root = self.resume(previous, board)
+        self.reused_search = root is not None
+        deadline = time.perf_counter() + time_limit if time_limit is not None else None
+        if self.workers > 1 and empty.bit_count() >= self.parallel_min_empty:
+            root = parallel.search_mcts(self, board, root, deadline)
+        else:
+            # The engines play O, whatever the stone counts say
+            root = self.search(board, True, self.iterations, deadline, root)
+        self.stats.finish_iteration(self.completed_depth)
+
+        self.root = root
+        best = root.best_child()
+        if best is None:
+            return None, self.nodes_explored
+        # best.value is O's, O played it
+        self.best_score = 2 * best.value / best.visits - 1
+        return best.move, self.nodes_explored
+
+    def resume(self, previous: Optional[RetainedSearch], board: Bitboard) -> Optional[MCTSNode]:
+        """The node of board in the tree previous kept, detached to be a root."""
+        if previous is None or previous.tree is None or previous.spec is not self.spec:
+            return None
+        if previous.continuation(board) is None:
+            return None
+        reply = (board[0] & ~previous.board[0]).bit_length() - 1
+        node = next((child for child in previous.tree.children if child.move == reply), None)
+        if node is None:
+            return None
+        node.parent = None
+        node.move = -1
+        return node
+
+    def retain(self, board: Bitboard, move: int) -> Optional[RetainedSearch]:
+        """The subtree below move for the next search, see search_memory.retain_search."""
+        root, self.root = self.root, None
+        if root is None:
+            return None
+        pv = []
+        node = next((child for child in root.children if child.move == move), None)
+        kept = node
+        while node is not None:
+            if node.move >= 0:
+                pv.append(node.move)
+            node = node.best_child()
+        if kept is not None:
+            # Cut loose from the old root so its other subtrees can be freed now
+            kept.parent = None
+            kept.move = -1
+            prune(kept)
+        return RetainedSearch(self.spec, board, move, self.best_score, self.completed_depth, pv or [move], {},
+                              kept)
+
+    def generate_tree(self, board: Bitboard, max_depth: int = 4, depth: int = 0,
+                      root_id: str = ROOT_ID, max_nodes: Optional[int] = None) -> Dict:
+        return self.build_tree(board, max_depth, depth, root_id, max_nodes).to_dict()
+
+    def build_tree(self, board: Bitboard, max_depth: int = 4, depth: int = 0,
+                   root_id: str = ROOT_ID, max_nodes: Optional[int] = None) -> CompactTree:
+        tree = CompactTree.from_nodes(self.spec, self.iter_tree(board, max_depth, depth, max_nodes),
+                                      max_depth, depth, root_id)
+        tree.nodes_explored = self.nodes_explored
+        tree.truncated = self.tree_truncated
+        return tree
+
+    def iter_tree(self, board: Bitboard, max_depth: int = 4, depth: int = 0,
+                  max_nodes: Optional[int] = None) -> Iterator[TreeNode]:
+        """Search board for self.iterations, then yield the tree down to max_depth.
+
+        Nodes come out in post-order, see TicTacToeAI.iter_tree. Children
+        come most visited first, the ones never visited are left out, and a
+        node's score is O's expected result from -1 to 1.
+        """
+        self.nodes_explored = 0
+        self.playouts = 0
+        self.completed_depth = 0
+        self.tree_truncated = False
+        self.cancel_requested = False
+        self.stats.reset()
+        spec = self.spec
+        root = self.search(board, player_to_move(board) == 'O', self.iterations)
+        self.stats.finish_iteration(self.completed_depth)
+        created = 1
+        numbered = 0
+
+        def create_node(node: MCTSNode, board_state: Bitboard, depth: int,
+                        parent: Optional[TreeNode]) -> Generator[TreeNode, None, None]:
+            nonlocal created, numbered
+            x, o = board_state
+            tree_node = TreeNode(numbered, parent, node.move, pack_board(spec, board_state), depth)
+            numbered += 1
+            o_to_move = player_to_move(board_state) == 'O'
+            # node.value is for the side that is not to move
+            mean = node.value / node.visits if node.visits else 0.5
+            tree_node.score = round(1 - 2 * mean if o_to_move else 2 * mean - 1, 3)
+
+            children = sorted(node.children, key=lambda child: -child.visits) if depth < max_depth else []
+            if children and max_nodes is not None and created + len(children) > max_nodes:
+                self.tree_truncated = True
+                children = children[:max(max_nodes - created, 0)]
+            created += len(children)
+            for child in children:
+                child_board = (x, o | 1 << child.move) if o_to_move else (x | 1 << child.move, o)
+                yield from create_node(child, child_board, depth + 1, tree_node)
+            if node.result is None and not children:
+                tree_node.flags = EXPANDABLE
+            yield tree_node
+
+        yield from create_node(root, board, depth, None)
+
+
+def prune(node: MCTSNode) -> None:
+    """Drop the children of node and below visited too little to be worth keeping."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        kept = []
+        for child in node.children:
+            if child.result is not None:
+                # Cost nothing to keep, and a win dropped here would have to be found again
+                kept.append(child)
+            elif child.visits >= MIN_RETAINED_VISITS:
+                kept.append(child)
+                stack.append(child)
+            else:
+                node.untried |= 1 << child.move
+        node.children = kept
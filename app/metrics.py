@@ -0,0 +1,266 @@
+# Request and search metrics in the Prometheus text format, served at
+# /metrics without the client library, and opt-in profiles of single
+# searches. Searches run on request threads and on the AI job pool, outside
+# any app context, so the registry and the profile store are module globals
+# like the shared transposition table, and everything in them takes a lock.
+
+import cProfile
+import io
+import pstats
+import secrets
+import time
+from bisect import bisect_left
+from collections import OrderedDict
+from threading import Lock
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, TypeVar
+from flask import Flask, Response, current_app, g, jsonify, request
+
+T = TypeVar('T')
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+NODE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000, 10000000)
+
+# Requests send this header to have their search profiled when PROFILING is 'header'
+PROFILE_HEADER = 'X-Profile'
+# Rows of the cumulative-time listing kept per profile
+PROFILE_ROWS = 40
+
+
+def format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in values)
+    return '{%s}' % ','.join('%s="%s"' % (name, value) for name, value in zip(names, escaped))
+
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = Lock()
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = ['# HELP %s %s' % (self.name, self.help_text), '# TYPE %s counter' % self.name]
+        with self.lock:
+            for label_values, value in sorted(self.values.items()):
+                lines.append('%s%s %s' % (self.name, format_labels(self.labels, label_values), format_value(value)))
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Per label set: count in each bucket (not cumulative, the last is +Inf), then sum
+        self.series: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+        self.lock = Lock()
+
+    def observe(self, value: float, *label_values: str) -> None:
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = ([0] * (len(self.buckets) + 1), [0.0])
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1][0] += value
+
+    def render(self) -> List[str]:
+        lines = ['# HELP %s %s' % (self.name, self.help_text), '# TYPE %s histogram' % self.name]
+        names = self.labels + ('le',)
+        with self.lock:
+            for label_values, (counts, total) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    lines.append('%s_bucket%s %d' % (self.name, format_labels(names, label_values + (format_value(bound),)),
+                                                     cumulative))
+                labels = format_labels(self.labels, label_values)
+                lines.append('%s_sum%s %s' % (self.name, labels, format_value(total[0])))
+                lines.append('%s_count%s %d' % (self.name, labels, cumulative))
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, help_text, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self, samples: Iterable[Tuple[str, str, str, float]] = ()) -> str:
+        """Every metric, then values read at scrape time as (name, type, help, value)."""
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for name, kind, help_text, value in samples:
+            lines.extend(('# HELP %s %s' % (name, help_text), '# TYPE %s %s' % (name, kind),
+                          '%s %s' % (name, format_value(value))))
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+request_seconds = registry.histogram('tictactoe_request_seconds', 'Request latency by route.',
+                                     ('route', 'method', 'status'))
+search_nodes = registry.histogram('tictactoe_search_nodes', 'Nodes visited per search.',
+                                  ('algorithm', 'kind'), NODE_BUCKETS)
+search_seconds = registry.histogram('tictactoe_search_seconds', 'Time spent per search.', ('algorithm', 'kind'))
+solved_lookups = registry.counter('tictactoe_solved_lookups_total', 'Moves answered from the solved table.',
+                                  ('algorithm',))
+
+
+class ProfileStore:
+    """The last max_profiles search profiles as text, by profile ID."""
+
+    def __init__(self, max_profiles: int = 100):
+        self.max_profiles = max_profiles
+        self.profiles = OrderedDict()
+        self.lock = Lock()
+
+    def add(self, profile: cProfile.Profile, description: str) -> str:
+        out = io.StringIO()
+        out.write(description + '\n')
+        pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(PROFILE_ROWS)
+        profile_id = secrets.token_urlsafe(9)
+        with self.lock:
+            self.profiles[profile_id] = out.getvalue()
+            while len(self.profiles) > self.max_profiles:
+                self.profiles.popitem(last=False)
+        return profile_id
+
+    def get(self, profile_id: str) -> Optional[str]:
+        with self.lock:
+            return self.profiles.get(profile_id)
+
+    def __len__(self) -> int:
+        return len(self.profiles)
+
+
+profiles = ProfileStore()
+
+
+def run_search(run: Callable[[], T], ai, algorithm: str, kind: str,
+               profile: bool = False) -> Tuple[T, Optional[str]]:
+    """run() recorded in the search metrics, kind is 'move' or 'tree'.
+
+    With profile it runs under cProfile and the ID of the stored profile is
+    returned next to its result.
+    """
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        try:
+            profiler.enable()
+        except ValueError:
+            # Only one profiler can run at a time, this search goes unprofiled
+            profiler = None
+    start = time.perf_counter()
+    try:
+        result = run()
+    finally:
+        if profiler is not None:
+            profiler.disable()
+    record_search(ai, algorithm, kind, time.perf_counter() - start)
+    profile_id = None
+    if profiler is not None:
+        profile_id = profiles.add(profiler, '%s %s search, %d nodes' % (algorithm, kind, ai.nodes_explored))
+    return result, profile_id
+
+
+def record_search(ai, algorithm: str, kind: str, seconds: float) -> None:
+    if getattr(ai, 'solved_lookup', False):
+        solved_lookups.inc(algorithm)
+        return
+    search_nodes.observe(ai.nodes_explored, algorithm, kind)
+    search_seconds.observe(seconds, algorithm, kind)
+
+
+def wants_profile() -> bool:
+    """Whether this request's search is profiled, see the PROFILING config."""
+    mode = current_app.config['PROFILING']
+    return mode == 'always' or (mode == 'header' and request.headers.get(PROFILE_HEADER, '') not in ('', '0'))
+
+
+# Keys of the stores' stats() that are current levels, every other one only ever grows
+LEVELS = {'live_games', 'max_games', 'entries', 'max_entries', 'in_flight', 'max_pending', 'pending'}
+
+
+def store_samples(prefix: str, description: str, stats: Dict[str, float]) -> List[Tuple[str, str, str, float]]:
+    samples = []
+    for key, value in stats.items():
+        help_text = '%s %s.' % (description, key.replace('_', ' '))
+        if key in LEVELS:
+            samples.append(('%s_%s' % (prefix, key), 'gauge', help_text, value))
+        else:
+            samples.append(('%s_%s_total' % (prefix, key), 'counter', help_text, value))
+    return samples
+
+
+def app_samples(app: Flask) -> List[Tuple[str, str, str, float]]:
+    # Read from the stores' own counters when scraped
+    from app.transposition import shared_table
+    game_store = app.extensions['game_store']
+    samples = store_samples('tictactoe_games', 'Game store', game_store.stats())
+    samples += store_samples('tictactoe_persistence', 'Game persistence', game_store.repository.stats())
+    samples += store_samples('tictactoe_tree_cache', 'Tree cache', app.extensions['tree_cache'].to_dict())
+    samples += store_samples('tictactoe_ai_jobs', 'AI job queue', app.extensions['ai_jobs'].stats())
+    samples += store_samples('tictactoe_transposition', 'Transposition table', {
+        'entries': len(shared_table),
+        'max_entries': shared_table.max_entries,
+        'hits': shared_table.hits,
+        'misses': shared_table.misses,
+        'evictions': shared_table.evictions
+    })
+    samples.append(('tictactoe_stored_profiles', 'gauge', 'Search profiles kept for /profiles.', len(profiles)))
+    for phase, seconds in app.extensions['startup'].items():
+        samples.append(('tictactoe_startup_%s_seconds' % phase, 'gauge',
+                        'Seconds the %s phase of the cold start took.' % phase.replace('_', ' '), seconds))
+    return samples
+
+
+def init_app(app: Flask) -> None:
+    """Time every request and serve /metrics and /profiles/<id>."""
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('request_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            request_seconds.observe(time.perf_counter() - start, route, request.method, str(response.status_code))
+        return response
+
+    def metrics():
+        return Response(registry.render(app_samples(current_app)), mimetype='text/plain; version=0.0.4')
+
+    def get_profile(profile_id):
+        profile = profiles.get(profile_id)
+        if profile is None:
+            return jsonify({'error': 'Unknown profile'}), 404
+        return Response(profile, mimetype='text/plain')
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
+    app.add_url_rule('/profiles/<profile_id>', 'get_profile', get_profile)
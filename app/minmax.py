@@ -1,221 +1,224 @@
 # Last updated: 2025-04-10 17:50:26 UTC
 # Author: its-lightning
 
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Generator, Iterator, Tuple, Optional
+from app.batch_eval import static_scores
+from app.bitboard import Bitboard, BoardSpec, STANDARD, player_to_move
+from app.evaluation import DEFAULT_WEIGHTS, LineCounters, evaluator
+from app.search_memory import RetainedSearch, resume_search
+from app.search_stats import SearchStats
+from app.solver import get_solved_table
+from app.transposition import TranspositionTable, EXACT, FULL_DRAFT, shared_table
+from app.tree import ROOT_ID, EXPANDABLE, CompactTree, TreeNode, pack_board
 
 class TicTacToeAI:
-    def __init__(self):
+    def __init__(self, spec: BoardSpec = STANDARD, table: Optional[TranspositionTable] = None):
+        self.spec = spec
         self.ai_player = 'O'
         self.human_player = 'X'
         self.nodes_explored = 0
-
-    def is_winner(self, board: List[str], player: str) -> bool:
-        # Check rows
-        for i in range(0, 9, 3):
-            if board[i] == board[i+1] == board[i+2] == player:
-                return True
-        
-        # Check columns
-        for i in range(3):
-            if board[i] == board[i+3] == board[i+6] == player:
-                return True
-        
-        # Check diagonals
-        if board[0] == board[4] == board[8] == player:
-            return True
-        if board[2] == board[4] == board[6] == player:
-            return True
-        
-        return False
-
-    def get_empty_cells(self, board: List[str]) -> List[int]:
-        return [i for i, cell in enumerate(board) if cell == '']
-
-    def evaluate_position(self, board: List[str]) -> int:
-        if self.is_winner(board, self.ai_player):
-            return 10
-        elif self.is_winner(board, self.human_player):
-            return -10
-        elif '' not in board:
-            return 0
-        
-        score = 0
-        lines = [
-            [0, 1, 2], [3, 4, 5], [6, 7, 8],  # rows
-            [0, 3, 6], [1, 4, 7], [2, 5, 8],  # columns
-            [0, 4, 8], [2, 4, 6]  # diagonals
-        ]
-        
-        for line in lines:
-            ai_count = sum(1 for i in line if board[i] == self.ai_player)
-            human_count = sum(1 for i in line if board[i] == self.human_player)
-            empty_count = sum(1 for i in line if board[i] == '')
-            
-            if ai_count == 2 and empty_count == 1:
-                score += 3
-            elif human_count == 2 and empty_count == 1:
-                score -= 3
-            elif ai_count == 1 and empty_count == 2:
-                score += 1
-            elif human_count == 1 and empty_count == 2:
-                score -= 1
-        
-        return score
-
-    def minimax(self, board: List[str], depth: int, is_maximizing: bool) -> Tuple[int, Optional[int]]:
+        self.table_hits = 0
+        self.table = table if table is not None else shared_table
+        self.live_search = False  # Skip the solved table and always search
+        self.solved_lookup = False
+        self.completed_depth = 0
+        self.best_score = None  # Value of the last get_best_move root for O
+        self.reused_search = False  # The last search was re-rooted from the previous move's
+        self.tree_truncated = False  # The last tree hit its node ceiling
+        # Plain minimax never cuts off, kept for parity with AlphaBetaAI stats
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.stats = SearchStats(spec.cells)
+        # Always searched serially, its boards are too small for the pool; kept for parity
+        self.workers = 0
+        # Plies searched before leaves are scored by the evaluator, None searches to the end of the game
+        self.search_depth = None
+        self.set_weights(DEFAULT_WEIGHTS)
+
+    def set_weights(self, weights: Tuple[int, ...]) -> None:
+        self.evaluator = evaluator(self.spec, weights)
+        # Heuristic leaf scores are scaled into (-1, 1), below any win or loss
+        self.heuristic_scale = self.evaluator.scale
+
+    def is_winner(self, board: Bitboard, player: str) -> bool:
+        return self.spec.is_win(board[0] if player == 'X' else board[1])
+
+    def get_empty_cells(self, board: Bitboard) -> List[int]:
+        return list(self.spec.moves(self.spec.full ^ (board[0] | board[1])))
+
+    def minimax(self, x: int, o: int, depth: int, is_maximizing: bool, max_depth: Optional[int] = None,
+                lines: Optional[LineCounters] = None) -> Tuple[float, Optional[int]]:
+        """Value of the position for O and the best move from it.
+
+        With a max_depth, positions that deep are scored by the evaluator
+        from lines, the counters of this position.
+        """
         self.nodes_explored += 1
-        empty_cells = self.get_empty_cells(board)
-        
-        if self.is_winner(board, self.ai_player):
-            return 10 - depth, None
-        if self.is_winner(board, self.human_player):
-            return depth - 10, None
-        if not empty_cells:
+        self.stats.nodes_by_ply[depth] += 1
+        spec = self.spec
+
+        if spec.is_win(o):
+            return spec.win_score - depth, None
+        if spec.is_win(x):
+            return depth - spec.win_score, None
+        empty = spec.full ^ (x | o)
+        if not empty:
             return 0, None
 
+        if max_depth is not None and depth >= max_depth:
+            return lines.score / self.heuristic_scale, None
+        draft = FULL_DRAFT if max_depth is None else max_depth - depth
+
+        # Plain minimax can only reuse exact values, bounds left by
+        # alpha-beta are ignored and overwritten
+        entry = self.table.probe(spec, x, o, is_maximizing, depth, draft, self.evaluator.weights)
+        if entry is not None and entry[0] == EXACT:
+            self.table_hits += 1
+            return entry[1], entry[2]
+
         if is_maximizing:
             max_eval = float('-inf')
             best_move = None
-            for pos in empty_cells:
-                board[pos] = self.ai_player
-                eval_score, _ = self.minimax(board, depth + 1, False)
-                board[pos] = ''
+            for pos in spec.moves(empty):
+                if lines is not None:
+                    lines.play(pos, True)
+                eval_score, _ = self.minimax(x, o | 1 << pos, depth + 1, False, max_depth, lines)
+                if lines is not None:
+                    lines.undo(pos, True)
                 if eval_score > max_eval:
                     max_eval = eval_score
                     best_move = pos
+            self.table.store(spec, x, o, is_maximizing, depth, EXACT, max_eval, best_move, draft,
+                             self.evaluator.weights)
             return max_eval, best_move
         else:
             min_eval = float('inf')
             best_move = None
-            for pos in empty_cells:
-                board[pos] = self.human_player
-                eval_score, _ = self.minimax(board, depth + 1, True)
-                board[pos] = ''
+            for pos in spec.moves(empty):
+                if lines is not None:
+                    lines.play(pos, False)
+                eval_score, _ = self.minimax(x | 1 << pos, o, depth + 1, True, max_depth, lines)
+                if lines is not None:
+                    lines.undo(pos, False)
                 if eval_score < min_eval:
                     min_eval = eval_score
                     best_move = pos
+            self.table.store(spec, x, o, is_maximizing, depth, EXACT, min_eval, best_move, draft,
+                             self.evaluator.weights)
             return min_eval, best_move
 
-    def get_best_move(self, board: List[str]) -> Tuple[Optional[int], int]:
+    def get_best_move(self, board: Bitboard, time_limit: Optional[float] = None,
+                      previous: Optional[RetainedSearch] = None) -> Tuple[Optional[int], int]:
+        # time_limit is accepted for parity with AlphaBetaAI, minimax always
+        # searches to the end of the game or to search_depth
         self.nodes_explored = 0
-        empty_cells = self.get_empty_cells(board)
-        if not empty_cells:
+        self.table_hits = 0
+        self.solved_lookup = False
+        self.completed_depth = 0
+        self.best_score = None
+        self.reused_search = False
+        self.stats.reset()
+        x, o = board
+
+        if not self.live_search and self.spec is STANDARD:
+            solved = get_solved_table()
+            answer = solved.best_move(board) if solved is not None else None
+            if answer is not None:
+                self.solved_lookup = True
+                move, self.best_score = answer
+                return move, self.nodes_explored
+
+        if not self.spec.full ^ (x | o):
             return None, self.nodes_explored
-            
-        _, best_move = self.minimax(board.copy(), 0, True)
+
+        # The exact values the previous search left below this position answer it
+        self.reused_search = resume_search(self, previous, board) is not None
+        empty = self.spec.full ^ (x | o)
+        max_depth = self.search_depth
+        lines = self.evaluator.counters(board) if max_depth is not None else None
+        self.best_score, best_move = self.minimax(x, o, 0, True, max_depth, lines)
+        self.completed_depth = empty.bit_count() if max_depth is None else min(max_depth, empty.bit_count())
+        self.stats.finish_iteration(self.completed_depth)
         return best_move, self.nodes_explored
 
-    def generate_tree(self, board: List[str], max_depth: int = 4) -> Dict:
-        self.nodes_explored = 0
+    def generate_tree(self, board: Bitboard, max_depth: int = 4, depth: int = 0,
+                      root_id: str = ROOT_ID, max_nodes: Optional[int] = None) -> Dict:
+        return self.build_tree(board, max_depth, depth, root_id, max_nodes).to_dict()
 
-        tree = {
-            'nodes': [],
-            'edges': [],
-            'maxDepth': max_depth,
-            'nodesExplored': 0
-        }
+    def build_tree(self, board: Bitboard, max_depth: int = 4, depth: int = 0,
+                   root_id: str = ROOT_ID, max_nodes: Optional[int] = None) -> CompactTree:
+        tree = CompactTree.from_nodes(self.spec, self.iter_tree(board, max_depth, depth, max_nodes),
+                                      max_depth, depth, root_id)
+        tree.nodes_explored = self.nodes_explored
+        tree.truncated = self.tree_truncated
+        return tree
 
-        def create_node(board_state: List[str], depth: int, parent_id: Optional[str] = None) -> Tuple[str, float]:
-            # Generate a unique node ID by including parent_id in the hash
-            node_id = str(hash((tuple(board_state), depth, parent_id)))
+    def iter_tree(self, board: Bitboard, max_depth: int = 4, depth: int = 0,
+                  max_nodes: Optional[int] = None) -> Iterator[TreeNode]:
+        """Yield the tree's nodes while it is being built.
 
-            # Determine current player based on board state
-            x_count = board_state.count('X')
-            o_count = board_state.count('O')
-            current_player = 'X' if x_count <= o_count else 'O'
-            is_maximizing = current_player == self.ai_player
-
-            score = self.evaluate_position(board_state)
-
-            # Add node to tree
-            tree['nodes'].append({
-                'id': node_id,
-                'board': board_state.copy(),
-                'score': score,
-                'depth': depth,
-                'isPruned': False,
-                'currentPlayer': current_player
-            })
-            tree['nodesExplored'] += 1
-
-            # Add edge if this isn't the root
-            if parent_id is not None:
-                tree['edges'].append({
-                    'from': parent_id,
-                    'to': node_id,
-                    'isPruned': False
-                })
-
-            # Base cases
-            if depth >= max_depth or self.is_winner(board_state, self.ai_player) or \
-            self.is_winner(board_state, self.human_player) or not self.get_empty_cells(board_state):
-                return node_id, score
-
-            empty_cells = self.get_empty_cells(board_state)
-
-            if is_maximizing:  # AI's turn (O)
-                max_eval = float('-inf')
-                for pos in empty_cells:
-                    new_board = board_state.copy()
-                    new_board[pos] = self.ai_player
-                    _, eval_score = create_node(new_board, depth + 1, node_id)
-                    max_eval = max(max_eval, eval_score)
-
-                # Update node score
-                for node in tree['nodes']:
-                    if node['id'] == node_id:
-                        node['score'] = max_eval
-                        break
-                return node_id, max_eval
-            else:  # Player's turn (X)
-                min_eval = float('inf')
-                for pos in empty_cells:
-                    new_board = board_state.copy()
-                    new_board[pos] = self.human_player
-                    _, eval_score = create_node(new_board, depth + 1, node_id)
-                    min_eval = min(min_eval, eval_score)
-
-                # Update node score
-                for node in tree['nodes']:
-                    if node['id'] == node_id:
-                        node['score'] = min_eval
-                        break
-                return node_id, min_eval
-
-        # Start tree generation
-        root_id, _ = create_node(board, 0)
-        tree['nodesExplored'] = self.nodes_explored
-        return tree
+        Nodes come out in post-order, so each already carries its final score
+        and its parent follows it. Pass depth to grow the subtree below a node
+        the caller already has. A node whose children would take the tree past
+        max_nodes is left as a leaf.
+        """
+        self.nodes_explored = 0
+        self.tree_truncated = False
+        self.stats.reset()
+        spec = self.spec
+        created = 1
+        start_depth = depth
+
+        def create_node(board_state: Bitboard, depth: int, parent: Optional[TreeNode] = None, move: int = -1,
+                        static: Optional[int] = None) -> Generator[TreeNode, None, float]:
+            nonlocal created
+            node = TreeNode(self.nodes_explored, parent, move, pack_board(spec, board_state), depth)
+            self.nodes_explored += 1
+            self.stats.nodes_by_ply[depth - start_depth] += 1
+            x, o = board_state
 
-    def evaluate_position(self, board):
-        if self.is_winner(board, self.ai_player):
-            return 10
-        elif self.is_winner(board, self.human_player):
-            return -10
-        elif '' not in board:
-            return 0
-        
-        # Heuristic evaluation for non-terminal positions
-        score = 0
-        # Check rows, columns, and diagonals for potential wins
-        lines = [
-            [0, 1, 2], [3, 4, 5], [6, 7, 8],  # rows
-            [0, 3, 6], [1, 4, 7], [2, 5, 8],  # columns
-            [0, 4, 8], [2, 4, 6]  # diagonals
-        ]
-        
-        for line in lines:
-            ai_count = sum(1 for i in line if board[i] == self.ai_player)
-            human_count = sum(1 for i in line if board[i] == self.human_player)
-            empty_count = sum(1 for i in line if board[i] == '')
-            
-            if ai_count == 2 and empty_count == 1:
-                score += 3
-            elif human_count == 2 and empty_count == 1:
-                score -= 3
-            elif ai_count == 1 and empty_count == 2:
-                score += 1
-            elif human_count == 1 and empty_count == 2:
-                score -= 1
-        
-        return score
\ No newline at end of file
+            # Determine current player based on board state
+            is_maximizing = player_to_move(board_state) == self.ai_player
+
+            score = static if static is not None else self.evaluate_position(board_state)
+            empty = spec.full ^ (x | o)
+            terminal = spec.is_win(o) or spec.is_win(x) or not empty
+
+            # Expand unless this is a leaf
+            moves = [] if depth >= max_depth or terminal else list(spec.moves(empty))
+            if moves and max_nodes is not None and created + len(moves) > max_nodes:
+                self.tree_truncated = True
+                moves = []
+            created += len(moves)
+
+            # Leaf children are scored together, see static_scores
+            statics = [None] * len(moves)
+            if moves and depth + 1 >= max_depth:
+                statics = static_scores(spec, [(x, o | 1 << pos) if is_maximizing else (x | 1 << pos, o)
+                                               for pos in moves], self.evaluate_position, self.evaluator.weights)
+
+            if moves:
+                if is_maximizing:  # AI's turn (O)
+                    max_eval = float('-inf')
+                    for pos, static in zip(moves, statics):
+                        eval_score = yield from create_node((x, o | 1 << pos), depth + 1, node, pos, static)
+                        max_eval = max(max_eval, eval_score)
+                    score = max_eval
+                else:  # Player's turn (X)
+                    min_eval = float('inf')
+                    for pos, static in zip(moves, statics):
+                        eval_score = yield from create_node((x | 1 << pos, o), depth + 1, node, pos, static)
+                        min_eval = min(min_eval, eval_score)
+                    score = min_eval
+
+            node.score = score
+            if not (terminal or moves):
+                node.flags = EXPANDABLE
+            yield node
+            return score
+
+        yield from create_node(board, depth)
+        self.stats.finish_iteration(max_depth - start_depth)
+
+    def evaluate_position(self, board: Bitboard) -> int:
+        return self.evaluator.evaluate(board)
@@ -0,0 +1,69 @@
+from typing import List, Optional
+from app.bitboard import BoardSpec
+
+# Ordering tiers, each far above anything the history table can reach
+TIER = 1 << 40
+WIN = 4 * TIER
+BLOCK = 3 * TIER
+HASH_MOVE = 2 * TIER
+KILLER = TIER
+
+KILLER_SLOTS = 2
+
+
+class MoveOrderer:
+    """Orders the moves of a search node so the likely best ones come first.
+
+    Moves that win on the spot go first, then moves that block an immediate
+    win of the opponent, then the transposition table's move, the killer
+    moves of the ply (moves that caused a cutoff in a sibling) and finally the
+    rest by history score plus a positional prior: the number of winning
+    lines through the cell, which favours the centre and then the corners.
+    """
+
+    def __init__(self, spec: BoardSpec):
+        self.spec = spec
+        self.prior = [sum(mask >> pos & 1 for mask in spec.win_masks) for pos in range(spec.cells)]
+        self.killers = []
+        self.history = []
+        self.clear()
+
+    def clear(self) -> None:
+        # One set of killers per ply below the position the search started from
+        self.killers = [[None] * KILLER_SLOTS for _ in range(self.spec.cells + 1)]
+        # One history table per side, indexed by is_maximizing
+        self.history = [[0] * self.spec.cells, [0] * self.spec.cells]
+
+    def order(self, me: int, opponent: int, empty: int, ply: int, is_maximizing: bool,
+              hash_move: Optional[int] = None) -> List[int]:
+        spec = self.spec
+        moves = spec.moves(empty)
+        if len(moves) < 2:
+            return list(moves)
+
+        is_win = spec.is_win
+        killers = self.killers[ply]
+        history = self.history[is_maximizing]
+        prior = self.prior
+        keys = {}
+        for pos in moves:
+            bit = 1 << pos
+            if is_win(me | bit):
+                keys[pos] = WIN
+            elif is_win(opponent | bit):
+                keys[pos] = BLOCK
+            elif pos == hash_move:
+                keys[pos] = HASH_MOVE
+            elif pos in killers:
+                keys[pos] = KILLER
+            else:
+                keys[pos] = history[pos] + prior[pos]
+        return sorted(moves, key=keys.__getitem__, reverse=True)
+
+    def record_cutoff(self, move: int, ply: int, is_maximizing: bool, remaining: int) -> None:
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        # Cutoffs high in the tree save the most work
+        self.history[is_maximizing][move] += remaining * remaining
@@ -0,0 +1,282 @@
+# Root-parallel search. The moves at the root are spread over a process pool
+# that is created once per server process and reused by every search. Alpha-
+# beta searches its first (best ordered) root move itself before handing out
+# the rest, young brothers wait style, so the workers start with a real bound;
+# they share the best score so far through a slot of shared memory, and each
+# child is searched with the bound current when it starts. The parent sets
+# its slot to ABORTED when it gives up on a search, so children still running
+# stop at their next look at the clock instead of holding the pool. Deadlines
+# are sent as wall-clock times, a task that waited in the queue only gets
+# what is left of the search's budget. Minimax is not searched here, it
+# only plays boards smaller than PARALLEL_MIN_EMPTY.
+#
+# Monte Carlo tree search splits its iterations instead: every worker grows
+# a tree of its own from the root with its own seed while the engine grows
+# its tree, and the visits and results of the workers' root children are
+# added to the engine's.
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+from app.bitboard import board_spec
+
+# Roots with fewer empty cells finish faster than the pool can ship them
+PARALLEL_MIN_EMPTY = 10
+# Searches that can use the pool at once, each needs a shared bound slot
+BOUND_SLOTS = 64
+# Bound of a search the parent gave up on, no score reaches it
+ABORTED = float('inf')
+
+pool: Optional[ProcessPoolExecutor] = None
+pool_pid: Optional[int] = None
+pool_lock = threading.Lock()
+bounds = None
+free_slots: Optional[queue.Queue] = None
+
+# Worker process state
+worker_bounds = None
+worker_engines: Dict[Tuple[str, Tuple[int, int, int]], object] = {}
+
+
+def get_pool(workers: int) -> ProcessPoolExecutor:
+    """The process pool of this process, created on first use."""
+    global pool, pool_pid, bounds, free_slots
+    with pool_lock:
+        # A forked server worker must not reuse its parent's pool
+        if pool is None or pool_pid != os.getpid():
+            bounds = multiprocessing.Array('d', BOUND_SLOTS)
+            free_slots = queue.Queue()
+            for slot in range(BOUND_SLOTS):
+                free_slots.put(slot)
+            pool = ProcessPoolExecutor(workers, initializer=init_worker, initargs=(bounds,))
+            pool_pid = os.getpid()
+        return pool
+
+
+def shutdown_pool() -> None:
+    global pool
+    with pool_lock:
+        if pool is not None and pool_pid == os.getpid():
+            pool.shutdown(cancel_futures=True)
+        pool = None
+
+
+def init_worker(shared_bounds) -> None:
+    global worker_bounds
+    worker_bounds = shared_bounds
+
+
+def wall_deadline(deadline: Optional[float]) -> Optional[float]:
+    """A perf_counter deadline of this process as a time.time() every process can read."""
+    return time.time() + deadline - time.perf_counter() if deadline is not None else None
+
+
+def local_deadline(deadline: Optional[float]) -> Optional[float]:
+    return time.perf_counter() + deadline - time.time() if deadline is not None else None
+
+
+def aborted_check(slot: int):
+    return lambda: worker_bounds[slot] == ABORTED
+
+
+def worker_engine(kind: str, dims: Tuple[int, int, int]):
+    # Engines, and with them the process's transposition table, live as long as the worker
+    engine = worker_engines.get((kind, dims))
+    if engine is None:
+        from app.game_logic import ENGINES
+        engine = ENGINES[kind](board_spec(*dims))
+        worker_engines[(kind, dims)] = engine
+    engine.nodes_explored = 0
+    engine.table_hits = 0
+    engine.cutoffs = 0
+    engine.first_move_cutoffs = 0
+    engine.stats.reset()
+    return engine
+
+
+def search_child(dims: Tuple[int, int, int], x: int, o: int, pos: int, max_depth: Optional[int],
+                 slot: int, deadline: Optional[float], move_ordering: bool,
+                 weights: Tuple[int, ...]) -> Optional[Dict]:
+    """Alpha-beta value of O playing pos, or None if the time ran out or the
+    parent gave up. deadline is a time.time(). Runs in a worker."""
+    from app.alphabeta import SearchTimeout
+    ai = worker_engine('alphabeta', dims)
+    if ai.evaluator.weights != weights:
+        ai.set_weights(weights)
+    child = o | 1 << pos
+    lines = ai.evaluator.counters((x, child)) if max_depth is not None else None
+    alpha = worker_bounds[slot]
+    if alpha == ABORTED:
+        return None
+    ai.move_ordering = move_ordering
+    ai.horizon_reached = False
+    # Without a deadline the clock is still looked at, for the abort
+    ai.deadline = local_deadline(deadline) if deadline is not None else float('inf')
+    ai.aborted = aborted_check(slot)
+    try:
+        score = ai.alpha_beta(x, child, 0, alpha, float('inf'), False, max_depth, lines)[0]
+    except SearchTimeout:
+        return None
+    finally:
+        ai.deadline = None
+        ai.aborted = None
+    if score > alpha:
+        with worker_bounds.get_lock():
+            if score > worker_bounds[slot]:
+                worker_bounds[slot] = score
+    return {
+        'score': score,
+        # Above the bound it started with the score is exact, otherwise only an upper bound
+        'exact': score > alpha,
+        'nodes': ai.nodes_explored,
+        'table_hits': ai.table_hits,
+        'cutoffs': ai.cutoffs,
+        'first_move_cutoffs': ai.first_move_cutoffs,
+        'horizon_reached': ai.horizon_reached,
+        'counts': ai.stats.counts()
+    }
+
+
+def search_root(ai, x: int, o: int, moves: Sequence[int],
+                max_depth: Optional[int] = None) -> Tuple[Optional[int], float]:
+    """Best root move for O and its score, searched on the pool on behalf of
+    the alpha-beta engine ai.
+
+    max_depth counts plies from the root's children, as in AlphaBetaAI.alpha_beta.
+
+    Node counts and stats of the workers are added to ai's. Raises
+    SearchTimeout if ai.deadline passes before every move is done.
+    """
+    executor = get_pool(ai.workers)
+    moves = list(moves)
+    results: List[Tuple[float, bool]] = []
+    futures = []
+    timed_out = False
+    slot = free_slots.get()
+    try:
+        bounds[slot] = float('-inf')
+        # The eldest brother first, its score is the bound the others start from
+        child = o | 1 << moves[0]
+        lines = ai.evaluator.counters((x, child)) if max_depth is not None else None
+        score = ai.alpha_beta(x, child, 0, float('-inf'), float('inf'), False, max_depth, lines)[0]
+        bounds[slot] = score
+        results.append((score, True))
+
+        deadline = wall_deadline(ai.deadline)
+        futures = [executor.submit(search_child, ai.spec.dims, x, o, pos, max_depth, slot,
+                                   deadline, ai.move_ordering, ai.evaluator.weights)
+                   for pos in moves[1:]]
+        for future in futures:
+            result = future.result()
+            if result is None:
+                timed_out = True
+                break
+            results.append((result['score'], result['exact']))
+            ai.nodes_explored += result['nodes']
+            ai.table_hits += result['table_hits']
+            ai.cutoffs += result['cutoffs']
+            ai.first_move_cutoffs += result['first_move_cutoffs']
+            if result['horizon_reached']:
+                ai.horizon_reached = True
+            ai.stats.merge(result['counts'])
+    finally:
+        if any(not future.done() for future in futures):
+            # Queued children never start, running ones stop at their next check
+            bounds[slot] = ABORTED
+            for future in futures:
+                future.cancel()
+        free_slots.put(slot)
+
+    if timed_out:
+        from app.alphabeta import SearchTimeout
+        raise SearchTimeout()
+
+    # Highest exact score, ties to the earliest move like the serial search.
+    # The bound only ever rises to exact scores, so the maximum has one.
+    best_score = max(score for score, _ in results)
+    best_index = next(i for i, (score, exact) in enumerate(results) if exact and score == best_score)
+    return moves[best_index], best_score
+
+
+def mcts_child(dims: Tuple[int, int, int], x: int, o: int, o_to_move: bool, iterations: int,
+               slot: int, deadline: Optional[float], seed: int, exploration: float) -> Dict:
+    """Root children of an MCTS search of its own from (x, o), stopping early
+    at deadline (a time.time()) or when the parent gives up. Runs in a worker."""
+    ai = worker_engine('mcts', dims)
+    ai.rng.seed(seed)
+    ai.exploration = exploration
+    ai.playouts = 0
+    ai.completed_depth = 0
+    ai.cancel_requested = False
+    if worker_bounds[slot] == ABORTED:
+        iterations = 0
+    ai.aborted = aborted_check(slot)
+    try:
+        root = ai.search((x, o), o_to_move, iterations, local_deadline(deadline))
+    finally:
+        ai.aborted = None
+    return {
+        'children': [(child.move, child.visits, child.value, child.result) for child in root.children],
+        'nodes': ai.nodes_explored,
+        'playouts': ai.playouts,
+        'depth': ai.completed_depth,
+        'counts': ai.stats.counts()
+    }
+
+
+def search_mcts(ai, board: Tuple[int, int], root, deadline: Optional[float]):
+    """ai's root after it and the workers shared its iterations, searched on the pool.
+
+    root is the tree to grow, None for a new one. Node counts and stats of
+    the workers are added to ai's. Raises SearchTimeout if ai is cancelled.
+    """
+    from app.mcts import MCTSNode
+    executor = get_pool(ai.workers)
+    x, o = board
+    share = max(ai.iterations // (ai.workers + 1), 1)
+    results = []
+    futures = []
+    slot = free_slots.get()
+    try:
+        bounds[slot] = float('-inf')
+        futures = [executor.submit(mcts_child, ai.spec.dims, x, o, True, share, slot, wall_deadline(deadline),
+                                   ai.rng.getrandbits(32), ai.exploration)
+                   for _ in range(ai.workers)]
+        root = ai.search(board, True, share, deadline, root)
+        results = [future.result() for future in futures]
+    finally:
+        if any(not future.done() for future in futures):
+            # A cancel: queued children never start, running ones stop at their next check
+            bounds[slot] = ABORTED
+            for future in futures:
+                future.cancel()
+        free_slots.put(slot)
+
+    children = {child.move: child for child in root.children}
+    for result in results:
+        for move, visits, value, outcome in result['children']:
+            child = children.get(move)
+            if child is None:
+                empty = ai.spec.full ^ (x | o | 1 << move)
+                child = children[move] = MCTSNode(move, root, empty if outcome is None else 0, outcome)
+                root.untried &= ~(1 << move)
+                root.children.append(child)
+            child.visits += visits
+            child.value += value
+            # The root's results are for the other side
+            root.visits += visits
+            root.value += visits - value
+        ai.nodes_explored += result['nodes']
+        ai.playouts += result['playouts']
+        ai.completed_depth = max(ai.completed_depth, result['depth'])
+        ai.stats.merge(result['counts'])
+    # A win on the spot found by any tree is the only move, as in MCTSAI.iterate
+    winning = next((child for child in root.children if child.result == 1.0), None)
+    if winning is not None:
+        root.children = [winning]
+        root.untried = 0
+    return root
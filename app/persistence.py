@@ -0,0 +1,256 @@
+# Game persistence. The GameStore keeps live games in memory and hands a
+# snapshot of each game to a GameRepository whenever the game changes; on a
+# miss (a restart, or a game started by another worker) it asks the
+# repository for the game. Every reset starts a new record, so finished games
+# stay in the repository as history and can be exported.
+#
+# SQLiteGameRepository never writes on the request thread. save() only puts
+# the snapshot into a dict of pending records, replacing any older snapshot
+# of the same record, and a writer thread flushes them in one transaction at
+# least every flush_interval seconds, or as soon as batch_size are pending.
+#
+# A live game is never reloaded, so with several server processes requests
+# for one game must stick to one process. A record only grows, one move at a
+# time, so a write never replaces a row holding more moves. A stale copy
+# left in another process cannot undo a newer game, its writes count as
+# stale instead.
+
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterator, Optional
+from app.bitboard import board_spec
+from app.game_logic import TicTacToeGame
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS games (
+    record_id TEXT PRIMARY KEY,
+    game_id TEXT NOT NULL,
+    rows INTEGER NOT NULL,
+    cols INTEGER NOT NULL,
+    k INTEGER NOT NULL,
+    algorithm TEXT NOT NULL,
+    moves TEXT NOT NULL,
+    current_player TEXT NOT NULL,
+    game_over INTEGER NOT NULL,
+    winner TEXT,
+    started_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS games_by_game_id ON games (game_id, updated_at);
+CREATE INDEX IF NOT EXISTS games_by_update ON games (updated_at);
+'''
+
+# Rows fetched at a time while exporting
+EXPORT_BATCH = 1000
+
+# Keeps the row when it already holds more moves than the snapshot written over it
+UPSERT = '''
+INSERT INTO games VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (record_id) DO UPDATE SET
+    algorithm = excluded.algorithm,
+    moves = excluded.moves,
+    current_player = excluded.current_player,
+    game_over = excluded.game_over,
+    winner = excluded.winner,
+    updated_at = excluded.updated_at
+WHERE json_array_length(excluded.moves) >= json_array_length(games.moves)
+'''
+
+
+def game_snapshot(game_id: str, game: TicTacToeGame) -> Dict:
+    """What the repository keeps of a game: enough to replay it."""
+    return {
+        'record_id': game.record_id,
+        'game_id': game_id,
+        'rows': game.spec.rows,
+        'cols': game.spec.cols,
+        'k': game.spec.k,
+        'algorithm': game.ai_stats['algorithm'],
+        'moves': list(game.moves),
+        'current_player': game.current_player,
+        'game_over': game.game_over,
+        'winner': game.winner,
+        'started_at': game.started_at,
+        'updated_at': time.time()
+    }
+
+
+def restore_game(snapshot: Dict) -> TicTacToeGame:
+    """A live game in the state the snapshot was taken in."""
+    game = TicTacToeGame(board_spec(snapshot['rows'], snapshot['cols'], snapshot['k']))
+    game.set_algorithm(snapshot['algorithm'])
+    x = o = 0
+    # X moves first and the players alternate
+    for ply, position in enumerate(snapshot['moves']):
+        if ply & 1:
+            o |= 1 << position
+        else:
+            x |= 1 << position
+    game.board = (x, o)
+    game.moves = list(snapshot['moves'])
+    game.current_player = snapshot['current_player']
+    game.game_over = bool(snapshot['game_over'])
+    game.winner = snapshot['winner']
+    game.record_id = snapshot['record_id']
+    game.started_at = snapshot['started_at']
+    return game
+
+
+class GameRepository:
+    """Where games outlive the process. The default keeps nothing."""
+
+    def save(self, snapshot: Dict) -> None:
+        pass
+
+    def load(self, game_id: str) -> Optional[Dict]:
+        """The latest snapshot of the game, None if it is unknown."""
+        return None
+
+    def export(self, since: float = 0.0, finished_only: bool = False) -> Iterator[Dict]:
+        """Every record updated after since, oldest first."""
+        return iter(())
+
+    def stats(self) -> Dict:
+        return {}
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteGameRepository(GameRepository):
+    def __init__(self, path: str, flush_interval: float = 0.5, batch_size: int = 500):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.pending: Dict[str, Dict] = {}  # record ID -> latest snapshot not yet written
+        self.writing: Dict[str, Dict] = {}  # The batch being written
+        self.condition = threading.Condition()
+        self.closed = False
+        self.saved = 0
+        self.written = 0
+        self.flushes = 0
+        self.stale = 0
+        self.errors = 0
+        self.last_error = None
+        with self.connect() as connection:
+            connection.executescript(SCHEMA)
+        self.writer = threading.Thread(target=self.write_behind, name='game-writer', daemon=True)
+        self.writer.start()
+
+    def connect(self) -> sqlite3.Connection:
+        # One connection per thread and call, WAL lets exports read while the writer writes
+        connection = sqlite3.connect(self.path, timeout=10)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def save(self, snapshot: Dict) -> None:
+        with self.condition:
+            self.pending[snapshot['record_id']] = snapshot
+            self.saved += 1
+            # The first snapshot starts the flush clock, a full batch ends it early
+            if len(self.pending) == 1 or len(self.pending) >= self.batch_size:
+                self.condition.notify()
+
+    def write_behind(self) -> None:
+        connection = self.connect()
+        try:
+            while True:
+                with self.condition:
+                    while not self.pending and not self.closed:
+                        self.condition.wait()
+                    # Give the batch time to fill, but never more than flush_interval
+                    deadline = time.monotonic() + self.flush_interval
+                    while len(self.pending) < self.batch_size and not self.closed:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self.condition.wait(remaining)
+                    batch, self.pending = self.pending, {}
+                    self.writing = batch
+                    closed = self.closed
+                if batch:
+                    self.write(connection, batch)
+                    with self.condition:
+                        self.writing = {}
+                if closed:
+                    return
+        finally:
+            connection.close()
+
+    def write(self, connection: sqlite3.Connection, batch: Dict[str, Dict]) -> None:
+        rows = [(s['record_id'], s['game_id'], s['rows'], s['cols'], s['k'], s['algorithm'],
+                 json.dumps(s['moves'], separators=(',', ':')), s['current_player'], int(s['game_over']),
+                 s['winner'], s['started_at'], s['updated_at']) for s in batch.values()]
+        changes = connection.total_changes
+        try:
+            with connection:
+                connection.executemany(UPSERT, rows)
+        except sqlite3.Error as e:
+            # Snapshots are whole games, the next save of each one repairs it
+            self.errors += 1
+            self.last_error = str(e)
+            return
+        written = connection.total_changes - changes
+        self.written += written
+        self.stale += len(rows) - written
+        self.flushes += 1
+
+    def load(self, game_id: str) -> Optional[Dict]:
+        with self.condition:
+            # Not written yet, but newer than anything in the database
+            pending = [s for batch in (self.pending, self.writing) for s in batch.values() if s['game_id'] == game_id]
+        if pending:
+            return max(pending, key=lambda s: s['updated_at'])
+        connection = self.connect()
+        try:
+            connection.row_factory = sqlite3.Row
+            row = connection.execute('SELECT * FROM games WHERE game_id = ? ORDER BY updated_at DESC LIMIT 1',
+                                     (game_id,)).fetchone()
+        finally:
+            connection.close()
+        return row_snapshot(row) if row is not None else None
+
+    def export(self, since: float = 0.0, finished_only: bool = False) -> Iterator[Dict]:
+        # A generator, rows are read a batch at a time while the caller streams them
+        connection = self.connect()
+        try:
+            connection.row_factory = sqlite3.Row
+            query = 'SELECT * FROM games WHERE updated_at > ?'
+            if finished_only:
+                query += ' AND game_over = 1'
+            cursor = connection.execute(query + ' ORDER BY updated_at', (since,))
+            while True:
+                rows = cursor.fetchmany(EXPORT_BATCH)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row_snapshot(row)
+        finally:
+            connection.close()
+
+    def stats(self) -> Dict:
+        with self.condition:
+            return {
+                'pending': len(self.pending),
+                'saved': self.saved,
+                'written': self.written,
+                'flushes': self.flushes,
+                'stale': self.stale,
+                'errors': self.errors
+            }
+
+    def close(self) -> None:
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.writer.join()
+
+
+def row_snapshot(row: sqlite3.Row) -> Dict:
+    snapshot = dict(row)
+    snapshot['moves'] = json.loads(snapshot['moves'])
+    snapshot['game_over'] = bool(snapshot['game_over'])
+    return snapshot
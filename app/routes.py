@@ -1,12 +1,130 @@
-from flask import Blueprint, render_template, jsonify, request
-from app.game_logic import TicTacToeGame
+import hashlib
+import json
+import time
+from flask import Blueprint, Response, current_app, render_template, jsonify, request, session
+from app.analysis import evaluate_positions
+from app.bitboard import board_spec, player_to_move
+from app.jobs import JobQueueFull
+from app.metrics import record_search, run_search, wants_profile
+from app.tree import ROOT_ID, TREE_FORMATS, node_records
 
 main = Blueprint('main', __name__)
-game = TicTacToeGame()
+
+def parse_spec(data):
+    dims = [data.get(name, 3) for name in ('rows', 'cols', 'k')]
+    # Checked rather than passed through int(), which would cut 1.5 down to 1
+    if not all(isinstance(value, int) and not isinstance(value, bool) for value in dims):
+        raise ValueError('Board dimensions must be integers')
+    return board_spec(*dims)
+
+def parse_position(spec, item):
+    """A board list, or {board, to_move}, as (bitboard, side to move)."""
+    to_move = None
+    if isinstance(item, dict):
+        to_move = item.get('to_move')
+        item = item.get('board')
+    if not isinstance(item, list):
+        raise ValueError('Each board must be a list of cells')
+    board = spec.encode(item)
+    if to_move is None:
+        to_move = player_to_move(board)
+    elif to_move not in ('X', 'O'):
+        raise ValueError('to_move must be X or O')
+    return board, to_move
+
+def parse_tree_format(data):
+    tree_format = data.get('format', 'json')
+    if tree_format not in TREE_FORMATS:
+        raise ValueError('format must be one of %s' % ', '.join(TREE_FORMATS))
+    return tree_format
+
+def parse_tree_limits(data, default_depth):
+    """Requested tree depth and node ceiling, clamped to the configured maximums."""
+    config = current_app.config
+    try:
+        depth = int(data.get('depth', default_depth))
+        max_nodes = int(data.get('max_nodes', config['MAX_TREE_NODES']))
+    except (TypeError, ValueError):
+        raise ValueError('depth and max_nodes must be integers')
+    if depth < 0 or max_nodes < 1:
+        raise ValueError('depth must be at least 0 and max_nodes at least 1')
+    return min(depth, config['MAX_TREE_DEPTH']), min(max_nodes, config['MAX_TREE_NODES'])
+
+def parse_search_depth(data):
+    """Requested AI search depth, None to search without a depth limit."""
+    depth = data.get('search_depth', current_app.config['SEARCH_DEPTH'])
+    if depth is None:
+        return None
+    try:
+        depth = int(depth)
+    except (TypeError, ValueError):
+        raise ValueError('search_depth must be an integer')
+    if depth < 1:
+        raise ValueError('search_depth must be at least 1')
+    return depth
+
+def get_game_session(data):
+    """Game for this request: an explicit game_id, otherwise the browser session's game."""
+    store = current_app.extensions['game_store']
+    if data.get('game_id') is not None:
+        return store.get(str(data['game_id']))
+    game_session = store.get_or_create(session.get('game_id'))
+    session['game_id'] = game_session.game_id
+    return game_session
+
+def game_state(game_session):
+    state = game_session.game.get_game_state()
+    state['game_id'] = game_session.game_id
+    return state
+
+def stream_tree(ai, algorithm, board, max_depth, max_nodes, depth=0, root_id=ROOT_ID):
+    """NDJSON response of tree records as the engine produces them, then a summary line."""
+    def generate():
+        start = time.perf_counter()
+        for node in ai.iter_tree(board, max_depth, depth, max_nodes):
+            for record in node_records(ai.spec, node, root_id):
+                yield json.dumps(record, separators=(',', ':')) + '\n'
+        record_search(ai, algorithm, 'tree', time.perf_counter() - start)
+        yield json.dumps({'type': 'summary', 'maxDepth': max_depth, 'nodesExplored': ai.nodes_explored,
+                          'truncated': ai.tree_truncated}, separators=(',', ':')) + '\n'
+    return Response(generate(), mimetype='application/x-ndjson')
+
+def tree_response(tree, tree_format, profile_id=None, cacheable=True):
+    """A built tree as the original nodes and edges JSON, or its columns in JSON or binary.
+
+    Trees of the deterministic engines only depend on the request, so their
+    body is tagged and a matching If-None-Match is answered with 304. MCTS
+    trees are a new sample every time and are never stored by the client.
+    """
+    if tree_format == 'binary':
+        response = Response(tree.to_bytes(), mimetype='application/octet-stream')
+    elif tree_format == 'columnar':
+        response = jsonify(tree.to_columns())
+    else:
+        response = jsonify(tree.to_dict())
+    if cacheable:
+        etag = hashlib.blake2b(response.get_data(), digest_size=16).hexdigest()
+        # make_conditional only answers GET, trees are fetched with POST
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        response.set_etag(etag)
+        # Answers to one session's POSTs, shared caches have no business keeping them
+        response.cache_control.private = True
+        response.cache_control.max_age = current_app.config['TREE_CACHE_MAX_AGE']
+    else:
+        response.cache_control.no_store = True
+    if profile_id is not None:
+        response.headers['X-Profile-Id'] = profile_id
+    return response
 
 @main.route('/')
 def index():
-    game.reset_game()
+    # Every page load starts a fresh game for this browser only
+    store = current_app.extensions['game_store']
+    if session.get('game_id'):
+        current_app.extensions['ai_jobs'].cancel_game(session['game_id'])
+        store.remove(session['game_id'])
+    session['game_id'] = store.create().game_id
     return render_template('game.html')
 
 @main.route('/make_move', methods=['POST'])
@@ -20,37 +138,220 @@ def make_move():
     
     try:
         position = int(position)
-    except ValueError:
+    except (TypeError, ValueError):
         return jsonify({'error': 'Invalid position format'}), 400
 
-    # Set the AI algorithm before making the move
-    game.set_algorithm(algorithm)
+    # Never spend longer than the configured budget, clients may ask for less
+    try:
+        time_limit = min(float(data.get('time_limit', current_app.config['MOVE_TIME_LIMIT'])),
+                         current_app.config['MOVE_TIME_LIMIT'])
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid time limit'}), 400
+    if not time_limit > 0:
+        return jsonify({'error': 'time_limit must be positive'}), 400
+    try:
+        search_depth = parse_search_depth(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    game_session = get_game_session(data)
+    if game_session is None:
+        return jsonify({'error': 'Unknown game'}), 404
+    jobs = current_app.extensions['ai_jobs']
+    run_async = bool(data.get('async', current_app.config['ASYNC_AI']))
+    # Answered before waiting for the lock, the job takes it to play its move
+    job = jobs.in_flight_job(game_session.game_id)
+    if job is not None:
+        return jsonify({'error': 'AI move in progress', 'job_id': job.job_id}), 409
+
+    with game_session.lock:
+        game = game_session.game
 
-    if game.make_move(position):
-        if not game.game_over:
-            game.ai_move()
-        return jsonify(game.get_game_state())
+        # The board is O's until the queued AI move lands, a job may have started since
+        job = jobs.in_flight_job(game_session.game_id)
+        if job is not None:
+            return jsonify({'error': 'AI move in progress', 'job_id': job.job_id}), 409
+
+        # Set the AI algorithm before making the move
+        try:
+            game.set_algorithm(algorithm)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        game.set_live_search(bool(data.get('live_search', current_app.config['LIVE_SEARCH'])))
+        game.set_search_workers(current_app.config['SEARCH_WORKERS'])
+        game.set_search_depth(search_depth)
+        game.set_eval_weights(current_app.config['EVAL_WEIGHTS'])
+        game.set_mcts_iterations(current_app.config['MCTS_ITERATIONS'])
+
+        if game.make_move(position):
+            store = current_app.extensions['game_store']
+            if not game.game_over:
+                if run_async:
+                    try:
+                        job = jobs.submit(game_session, time_limit, wants_profile())
+                    except JobQueueFull:
+                        pass  # Answer inline rather than turn the move away
+                    else:
+                        store.save(game_session)
+                        state = game_state(game_session)
+                        state['job_id'] = job.job_id
+                        return jsonify(state), 202
+                game.ai_move(time_limit, wants_profile())
+            store.save(game_session)
+            return jsonify(game_state(game_session))
     return jsonify({'error': 'Invalid move'}), 400
 
 @main.route('/get_tree', methods=['POST'])
 def get_tree():
     data = request.json
-    board = data.get('board', [''] * 9)
     algorithm = data.get('algorithm', 'minmax')
-    
-    # Set the algorithm before generating tree
-    game.set_algorithm(algorithm)
-    
-    # Adjust depth based on algorithm
-    if algorithm == 'alphabeta':
-        depth = 3  # Increased depth for alpha-beta
-    else:
-        depth = 3  # Keep original depth for minmax
-        
-    tree_data = game.generate_tree(board, depth)
-    return jsonify(tree_data)
+
+    game_session = get_game_session(data)
+    if game_session is None:
+        return jsonify({'error': 'Unknown game'}), 404
+
+    with game_session.lock:
+        game = game_session.game
+        try:
+            depth, max_nodes = parse_tree_limits(data, current_app.config['TREE_DEPTH'])
+            tree_format = parse_tree_format(data)
+            board = game.spec.encode(data.get('board', [''] * game.spec.cells))
+            # Set the algorithm before generating tree
+            game.set_algorithm(algorithm)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        game.set_eval_weights(current_app.config['EVAL_WEIGHTS'])
+        game.set_mcts_iterations(current_app.config['MCTS_ITERATIONS'])
+
+        algorithm = game.ai_stats['algorithm']
+        profile_id = None
+        # Every MCTS search grows a different tree, caching one would freeze a single sample
+        cacheable = not getattr(game.current_ai, 'stochastic', False)
+        if data.get('stream'):
+            ai = game.detached_engine()
+        elif not cacheable:
+            tree, profile_id = game.build_tree(board, depth, max_nodes, wants_profile())
+        else:
+            tree_cache = current_app.extensions['tree_cache']
+            settings = game.tree_settings()
+            tree = tree_cache.get(game.spec, board, algorithm, settings, depth, max_nodes)
+            if tree is None:
+                tree, profile_id = game.build_tree(board, depth, max_nodes, wants_profile())
+                tree_cache.put(game.spec, board, algorithm, settings, depth, max_nodes, tree)
+
+    if data.get('stream'):
+        # The tree is built while the response is sent, on an engine of its own
+        return stream_tree(ai, algorithm, board, depth, max_nodes)
+    return tree_response(tree, tree_format, profile_id, cacheable)
+
+@main.route('/expand_node', methods=['POST'])
+def expand_node():
+    """Subtree below one node of a tree returned by /get_tree."""
+    data = request.json
+    algorithm = data.get('algorithm', 'minmax')
+
+    game_session = get_game_session(data)
+    if game_session is None:
+        return jsonify({'error': 'Unknown game'}), 404
+
+    try:
+        node_id = str(data['node_id'])
+        node_depth = int(data.get('node_depth', 0))
+        # Here depth counts the levels grown below the node
+        levels, max_nodes = parse_tree_limits(data, current_app.config['TREE_EXPAND_DEPTH'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'node_id, an integer node_depth and valid limits are required'}), 400
+
+    with game_session.lock:
+        game = game_session.game
+        try:
+            board = game.spec.encode(data.get('board'))
+            if not 0 <= node_depth <= game.spec.cells:
+                raise ValueError('node_depth must be between 0 and %d' % game.spec.cells)
+            tree_format = parse_tree_format(data)
+            game.set_algorithm(algorithm)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        game.set_eval_weights(current_app.config['EVAL_WEIGHTS'])
+        game.set_mcts_iterations(current_app.config['MCTS_ITERATIONS'])
+        algorithm = game.ai_stats['algorithm']
+        ai = game.detached_engine()
+
+    if data.get('stream'):
+        return stream_tree(ai, algorithm, board, node_depth + levels, max_nodes, node_depth, node_id)
+    tree, profile_id = run_search(lambda: ai.build_tree(board, node_depth + levels, node_depth, node_id, max_nodes),
+                                  ai, algorithm, 'tree', wants_profile())
+    return tree_response(tree, tree_format, profile_id, not getattr(ai, 'stochastic', False))
+
+@main.route('/games/export')
+def export_games():
+    """Stored games as NDJSON, oldest first. ?since=<unix time> and ?finished=1 narrow it down."""
+    try:
+        since = float(request.args.get('since', 0))
+    except ValueError:
+        return jsonify({'error': 'Invalid since'}), 400
+    finished_only = request.args.get('finished', '') not in ('', '0')
+    games = current_app.extensions['game_store'].repository.export(since, finished_only)
+
+    def generate():
+        for snapshot in games:
+            yield json.dumps(snapshot, separators=(',', ':')) + '\n'
+    return Response(generate(), mimetype='application/x-ndjson')
+
+@main.route('/tree_cache')
+def tree_cache_stats():
+    return jsonify(current_app.extensions['tree_cache'].to_dict())
+
+@main.route('/jobs/<job_id>')
+def get_job(job_id):
+    """State of a queued AI move. ?wait=seconds long-polls until it finishes."""
+    jobs = current_app.extensions['ai_jobs']
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0.0), current_app.config['JOB_MAX_WAIT'])
+    except ValueError:
+        return jsonify({'error': 'Invalid wait'}), 400
+    if wait:
+        jobs.wait(job, wait)
+    return jsonify(job.to_dict())
+
+@main.route('/evaluate', methods=['POST'])
+def evaluate():
+    # Stateless analysis, nothing here touches the caller's game
+    data = request.get_json(silent=True) or {}
+    boards = data.get('boards')
+    if not isinstance(boards, list) or not boards:
+        return jsonify({'error': 'boards must be a non-empty list'}), 400
+    if len(boards) > current_app.config['MAX_EVALUATE_BOARDS']:
+        return jsonify({'error': 'At most %d boards per request' % current_app.config['MAX_EVALUATE_BOARDS']}), 400
+
+    try:
+        spec = parse_spec(data)
+        positions = [parse_position(spec, item) for item in boards]
+        # One move's budget for the whole batch, however many boards it has
+        result = evaluate_positions(spec, positions, data.get('algorithm', 'alphabeta'),
+                                    bool(data.get('live_search', current_app.config['LIVE_SEARCH'])),
+                                    current_app.config['MOVE_TIME_LIMIT'])
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(result)
 
 @main.route('/reset', methods=['POST'])
 def reset():
-    game.reset_game()
-    return jsonify(game.get_game_state())
\ No newline at end of file
+    data = request.get_json(silent=True) or {}
+    try:
+        spec = parse_spec(data)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    game_session = get_game_session(data)
+    if game_session is None:
+        return jsonify({'error': 'Unknown game'}), 404
+    # Stop a queued or running AI move first, it holds the game while it searches
+    current_app.extensions['ai_jobs'].cancel_game(game_session.game_id)
+    with game_session.lock:
+        game_session.game.reset_game(spec)
+        current_app.extensions['game_store'].save(game_session)
+        return jsonify(game_state(game_session))
\ No newline at end of file
@@ -0,0 +1,105 @@
+# What one AI move's search learned, kept by the game for the next one. The
+# position the human answers with is almost always inside the subtree just
+# searched, so the table entries of that subtree (scores and bounds) are
+# exported next to the principal variation. Other games share the table and
+# may have evicted them by the next move; restoring them re-roots the old
+# search at the new position, and the rest of the principal variation orders
+# the first iteration.
+
+from typing import Dict, Iterator, List, Optional, Tuple
+from app.bitboard import Bitboard, BoardSpec
+
+
+class RetainedSearch:
+    def __init__(self, spec: BoardSpec, board: Bitboard, move: int, score: Optional[float], depth: int,
+                 pv: List[int], entries: Dict[Tuple, Tuple], tree=None):
+        self.spec = spec
+        self.board = board  # Position the search was run from, O to move
+        self.move = move  # Move O played from it
+        self.score = score
+        self.depth = depth
+        self.pv = pv  # Starts with move, then alternates X and O
+        self.entries = entries
+        self.tree = tree  # Engines that keep a search tree (MCTSAI) hand the subtree below move here
+
+    def continuation(self, board: Bitboard) -> Optional[List[int]]:
+        """The rest of the principal variation if board is this search's root after
+        its move and one reply of X, [] if X played off it, None if board is not
+        in the retained subtree at all."""
+        x, o = self.board
+        new_x, new_o = board
+        reply = new_x & ~x
+        if new_o != o | 1 << self.move or new_x & x != x or reply.bit_count() != 1 or reply & new_o:
+            return None
+        if len(self.pv) > 1 and reply == 1 << self.pv[1]:
+            return self.pv[2:]
+        return []
+
+
+def principal_variation(ai, board: Bitboard, move: int) -> List[int]:
+    """move followed by the best replies the table knows of, until the game ends."""
+    spec = ai.spec
+    x, o = board
+    o |= 1 << move
+    pv = [move]
+    is_maximizing = False
+    while not (spec.is_win(x) or spec.is_win(o)):
+        empty = spec.full ^ (x | o)
+        entry = ai.table.peek(spec, x, o, is_maximizing, weights=ai.evaluator.weights)
+        if not empty or entry is None or entry[2] is None or not empty >> entry[2] & 1:
+            break
+        pv.append(entry[2])
+        if is_maximizing:
+            o |= 1 << entry[2]
+        else:
+            x |= 1 << entry[2]
+        is_maximizing = not is_maximizing
+    return pv
+
+
+def subtree_positions(spec: BoardSpec, board: Bitboard, pv: List[int]) -> Iterator[Tuple[int, int, bool]]:
+    # The position after O's move, every reply of X to it (the next roots) and
+    # every move of O from those (the next roots' children), then the rest of
+    # the principal variation
+    x, o = board
+    o |= 1 << pv[0]
+    yield x, o, False
+    if spec.is_win(o):
+        return
+    for reply in spec.moves(spec.full ^ (x | o)):
+        root_x = x | 1 << reply
+        yield root_x, o, True
+        if spec.is_win(root_x):
+            continue
+        for pos in spec.moves(spec.full ^ (root_x | o)):
+            yield root_x, o | 1 << pos, False
+    is_maximizing = False
+    for pos in pv[1:]:
+        if is_maximizing:
+            o |= 1 << pos
+        else:
+            x |= 1 << pos
+        is_maximizing = not is_maximizing
+        yield x, o, is_maximizing
+
+
+def retain_search(ai, board: Bitboard, move: Optional[int]) -> Optional[RetainedSearch]:
+    """What ai's last get_best_move from board found, None if it did not search."""
+    if move is None or ai.solved_lookup:
+        return None
+    if hasattr(ai, 'retain'):
+        return ai.retain(board, move)
+    pv = principal_variation(ai, board, move)
+    entries = ai.table.export(ai.spec, subtree_positions(ai.spec, board, pv), ai.evaluator.weights)
+    return RetainedSearch(ai.spec, board, move, ai.best_score, ai.completed_depth, pv, entries)
+
+
+def resume_search(ai, previous: Optional[RetainedSearch], board: Bitboard) -> Optional[List[int]]:
+    """Re-root previous at board for ai's next search, returning its principal
+    variation from board or None if previous has nothing to say about it."""
+    if previous is None or previous.spec is not ai.spec:
+        return None
+    continuation = previous.continuation(board)
+    if continuation is not None:
+        ai.table.restore(previous.entries)
+    return continuation
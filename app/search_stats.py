@@ -0,0 +1,102 @@
+import json
+import logging
+import time
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SearchStats:
+    """Instrumentation for one search or tree build.
+
+    Counters are indexed by ply, the number of moves below the position the
+    search started from (0 is that position itself). A cutoff at a ply skips
+    the remaining sibling subtrees of the move that caused it; their count is
+    kept per ply as pruned_by_ply, and pruned_heights counts them by the
+    number of empty cells left in them, which bounds how large they were.
+    """
+
+    def __init__(self, cells: int):
+        self.cells = cells
+        self.nodes_by_ply: List[int] = []
+        self.cutoffs_by_ply: List[int] = []
+        self.pruned_by_ply: List[int] = []
+        self.pruned_heights: Dict[int, int] = {}
+        # (depth limit, seconds, completed) per search iteration
+        self.ply_times: List[Tuple[int, float, bool]] = []
+        self.mark = 0.0
+        self.reset()
+
+    def reset(self) -> None:
+        self.nodes_by_ply = [0] * (self.cells + 1)
+        self.cutoffs_by_ply = [0] * (self.cells + 1)
+        self.pruned_by_ply = [0] * (self.cells + 1)
+        self.pruned_heights = {}
+        self.ply_times = []
+        self.mark = time.perf_counter()
+
+    def record_cutoff(self, ply: int, skipped: int, empty_cells: int) -> None:
+        self.cutoffs_by_ply[ply] += 1
+        if skipped:
+            self.pruned_by_ply[ply] += skipped
+            # Each skipped child has one cell fewer left to fill
+            height = empty_cells - 1
+            self.pruned_heights[height] = self.pruned_heights.get(height, 0) + skipped
+
+    def finish_iteration(self, depth: int, completed: bool = True) -> None:
+        now = time.perf_counter()
+        self.ply_times.append((depth, now - self.mark, completed))
+        self.mark = now
+
+    def counts(self) -> Tuple[List[int], List[int], List[int], Dict[int, int]]:
+        return self.nodes_by_ply, self.cutoffs_by_ply, self.pruned_by_ply, self.pruned_heights
+
+    def merge(self, counts: Tuple[List[int], List[int], List[int], Dict[int, int]]) -> None:
+        """Add the counters of a search run elsewhere, e.g. in a worker process."""
+        nodes, cutoffs, pruned, heights = counts
+        for ply in range(len(nodes)):
+            self.nodes_by_ply[ply] += nodes[ply]
+            self.cutoffs_by_ply[ply] += cutoffs[ply]
+            self.pruned_by_ply[ply] += pruned[ply]
+        for height, count in heights.items():
+            self.pruned_heights[height] = self.pruned_heights.get(height, 0) + count
+
+    @property
+    def nodes(self) -> int:
+        return sum(self.nodes_by_ply)
+
+    def effective_branching_factor(self) -> float:
+        """b such that b + b^2 + ... + b^d equals the nodes visited below the start."""
+        depth = max((ply for ply, count in enumerate(self.nodes_by_ply) if count and ply), default=0)
+        nodes = sum(self.nodes_by_ply[1:])
+        if not depth or nodes <= depth:
+            return float(bool(nodes))
+        low, high = 1.0, float(nodes)
+        for _ in range(50):
+            b = (low + high) / 2
+            if sum(b ** i for i in range(1, depth + 1)) < nodes:
+                low = b
+            else:
+                high = b
+        return round(low, 3)
+
+    def to_dict(self) -> Dict:
+        deepest = max((ply for ply, count in enumerate(self.nodes_by_ply) if count), default=0) + 1
+        return {
+            'nodes': self.nodes,
+            'nodes_by_ply': self.nodes_by_ply[:deepest],
+            'cutoffs': sum(self.cutoffs_by_ply),
+            'cutoffs_by_ply': self.cutoffs_by_ply[:deepest],
+            'pruned_subtrees': sum(self.pruned_by_ply),
+            'pruned_by_ply': self.pruned_by_ply[:deepest],
+            'pruned_heights': {str(height): count for height, count in sorted(self.pruned_heights.items())},
+            'effective_branching_factor': self.effective_branching_factor(),
+            'ply_times': [{'depth': depth, 'seconds': round(seconds, 6), 'completed': completed}
+                          for depth, seconds, completed in self.ply_times],
+            'seconds': round(sum(seconds for _, seconds, _ in self.ply_times), 6)
+        }
+
+    def log(self, **fields) -> None:
+        """Emit the stats as one JSON log record on the app.search_stats logger."""
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(json.dumps(dict(fields, event='search', **self.to_dict()), separators=(',', ':')))
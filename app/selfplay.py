@@ -0,0 +1,257 @@
+# Headless self-play for bulk game generation. Games are played on bitboards
+# straight through the engines, without TicTacToeGame, so a move is one
+# engine call and a win check is one table lookup. Games are played in
+# chunks by a process pool. Each chunk comes back as packed records, and the
+# parent writes them to the output file in order as they arrive. The file
+# holds one run and is overwritten if it exists:
+#
+#   python -m app.selfplay --x alphabeta --o epsilon:0.2 --games 1000000 --workers 8 --output games.bin
+#
+# Agents are minmax, alphabeta, mcts, random, or epsilon:<e>[:<engine>], which plays
+# a random move with probability e and the engine's move (alphabeta unless
+# given) otherwise. The engines always play O, so X's moves are searched on
+# the colour-swapped board, as in analysis.
+
+import argparse
+import json
+import os
+import random
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+from app.bitboard import BoardSpec, STANDARD, board_spec
+from app.game_logic import ENGINES, MAX_MINMAX_CELLS
+from app.solver import get_solved_table, load_solved_table
+
+# File layout: the header, the X and O agent names (UTF-8, each preceded by
+# its uint8 length), then one record per game: a uint8 result (RESULTS), a
+# uint8 move count and that many uint8 cells, in the order they were played.
+MAGIC = b'TTTG'
+HEADER = struct.Struct('<4sBBB')
+RESULTS = {'tie': 0, 'X': 1, 'O': 2}
+RESULT_NAMES = {code: name for name, code in RESULTS.items()}
+
+# Games per task handed to a worker
+DEFAULT_CHUNK = 2000
+# Positions an engine agent remembers its move for before starting afresh
+MEMO_LIMIT = 1 << 20
+
+
+class RandomAgent:
+    def __init__(self, spec: BoardSpec):
+        self.spec = spec
+
+    def choose(self, x: int, o: int, x_to_move: bool, rng: random.Random) -> int:
+        return rng.choice(self.spec.moves(self.spec.full ^ (x | o)))
+
+
+class EngineAgent:
+    """Plays an engine's best move. Moves are remembered by position, the
+    engines are deterministic for a position once their table is warm, except
+    the stochastic ones (MCTS), which search every time."""
+
+    def __init__(self, spec: BoardSpec, kind: str, time_limit: Optional[float] = None):
+        if kind == 'minmax' and spec.cells > MAX_MINMAX_CELLS:
+            raise ValueError('MinMax only supports boards up to %d cells, use alphabeta' % MAX_MINMAX_CELLS)
+        self.ai = ENGINES[kind](spec)
+        self.time_limit = time_limit
+        self.moves = {} if not getattr(self.ai, 'stochastic', False) else None
+
+    def choose(self, x: int, o: int, x_to_move: bool, rng: random.Random) -> int:
+        board = (o, x) if x_to_move else (x, o)
+        if self.moves is None:
+            return self.ai.get_best_move(board, self.time_limit)[0]
+        move = self.moves.get(board)
+        if move is None:
+            move = self.ai.get_best_move(board, self.time_limit)[0]
+            if len(self.moves) >= MEMO_LIMIT:
+                self.moves.clear()
+            self.moves[board] = move
+        return move
+
+
+class EpsilonGreedyAgent:
+    def __init__(self, spec: BoardSpec, epsilon: float, greedy: EngineAgent):
+        if not 0 <= epsilon <= 1:
+            raise ValueError('epsilon must be between 0 and 1')
+        self.epsilon = epsilon
+        self.greedy = greedy
+        self.explore = RandomAgent(spec)
+
+    def choose(self, x: int, o: int, x_to_move: bool, rng: random.Random) -> int:
+        if rng.random() < self.epsilon:
+            return self.explore.choose(x, o, x_to_move, rng)
+        return self.greedy.choose(x, o, x_to_move, rng)
+
+
+def make_agent(name: str, spec: BoardSpec, time_limit: Optional[float] = None):
+    kind, _, params = name.partition(':')
+    if kind == 'random' and not params:
+        return RandomAgent(spec)
+    if kind in ENGINES and not params:
+        return EngineAgent(spec, kind, time_limit)
+    if kind == 'epsilon' and params:
+        epsilon, _, engine = params.partition(':')
+        try:
+            epsilon = float(epsilon)
+        except ValueError:
+            raise ValueError('Invalid epsilon in %r' % name)
+        if engine not in ('',) + tuple(ENGINES):
+            raise ValueError('Unknown engine in %r' % name)
+        return EpsilonGreedyAgent(spec, epsilon, EngineAgent(spec, engine or 'alphabeta', time_limit))
+    raise ValueError('Unknown agent: %s' % name)
+
+
+def play_game(spec: BoardSpec, x_agent, o_agent, rng: random.Random) -> Tuple[str, bytes]:
+    """One game, X first, as its result and the cells played."""
+    x = o = 0
+    moves = bytearray()
+    for ply in range(spec.cells):
+        if ply & 1:
+            move = o_agent.choose(x, o, False, rng)
+            o |= 1 << move
+            moves.append(move)
+            if spec.is_win(o):
+                return 'O', bytes(moves)
+        else:
+            move = x_agent.choose(x, o, True, rng)
+            x |= 1 << move
+            moves.append(move)
+            if spec.is_win(x):
+                return 'X', bytes(moves)
+    return 'tie', bytes(moves)
+
+
+# Worker process state, agents keep their engines and memos between chunks
+worker_agents: Dict[Tuple, Tuple] = {}
+
+
+def play_chunk(dims: Tuple[int, int, int], x_name: str, o_name: str, time_limit: Optional[float],
+               games: int, seed: int) -> Tuple[bytes, Dict[str, int], int]:
+    """Play games with their own seeded generator, returning the packed records,
+    the count of each result and the number of moves. Runs in a worker."""
+    spec = board_spec(*dims)
+    key = (dims, x_name, o_name, time_limit)
+    agents = worker_agents.get(key)
+    if agents is None:
+        if spec is STANDARD and get_solved_table() is None:
+            load_solved_table()
+        agents = worker_agents[key] = (make_agent(x_name, spec, time_limit), make_agent(o_name, spec, time_limit))
+    rng = random.Random(seed)
+    records = bytearray()
+    results = dict.fromkeys(RESULTS, 0)
+    plies = 0
+    for _ in range(games):
+        result, moves = play_game(spec, agents[0], agents[1], rng)
+        records.append(RESULTS[result])
+        records.append(len(moves))
+        records += moves
+        results[result] += 1
+        plies += len(moves)
+    return bytes(records), results, plies
+
+
+def write_header(out: BinaryIO, spec: BoardSpec, x_name: str, o_name: str) -> None:
+    out.write(HEADER.pack(MAGIC, spec.rows, spec.cols, spec.k))
+    for name in (x_name, o_name):
+        encoded = name.encode('utf-8')
+        out.write(bytes((len(encoded),)) + encoded)
+
+
+def read_games(path: str) -> Iterator[Tuple[str, List[int]]]:
+    """(result, cells played) of every game in a file written by run()."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, _, _, _ = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError('Not a self-play file')
+    offset = HEADER.size
+    for _ in range(2):
+        offset += 1 + data[offset]
+    while offset < len(data):
+        result, count = data[offset], data[offset + 1]
+        yield RESULT_NAMES[result], list(data[offset + 2:offset + 2 + count])
+        offset += 2 + count
+
+
+def run(games: int, x_name: str = 'alphabeta', o_name: str = 'alphabeta', spec: BoardSpec = STANDARD,
+        workers: int = 0, chunk: int = DEFAULT_CHUNK, seed: int = 0, time_limit: Optional[float] = None,
+        output: Optional[str] = None) -> Dict:
+    """Play games and return the result counts and throughput, writing the
+    games to output, replacing it, as they come in. Workers 0 or 1 play in
+    this process."""
+    # Agent names are checked here rather than in the first worker
+    make_agent(x_name, spec, time_limit)
+    make_agent(o_name, spec, time_limit)
+
+    sizes = [min(chunk, games - start) for start in range(0, games, chunk)]
+    tasks = [(spec.dims, x_name, o_name, time_limit, size, seed + i) for i, size in enumerate(sizes)]
+    results = dict.fromkeys(RESULTS, 0)
+    plies = 0
+    out = open(output, 'wb') if output else None
+    pool = ProcessPoolExecutor(workers) if workers > 1 else None
+    start = time.perf_counter()
+    try:
+        if out is not None:
+            write_header(out, spec, x_name, o_name)
+        chunks = pool.map(play_chunk, *zip(*tasks)) if pool is not None and tasks else \
+            (play_chunk(*task) for task in tasks)
+        for records, chunk_results, chunk_plies in chunks:
+            if out is not None:
+                out.write(records)
+            for result, count in chunk_results.items():
+                results[result] += count
+            plies += chunk_plies
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        if out is not None:
+            out.close()
+    elapsed = time.perf_counter() - start
+
+    return {
+        'board': {'rows': spec.rows, 'cols': spec.cols, 'k': spec.k},
+        'x': x_name,
+        'o': o_name,
+        'games': games,
+        'x_wins': results['X'],
+        'o_wins': results['O'],
+        'ties': results['tie'],
+        'moves': plies,
+        'workers': max(workers, 1),
+        'seed': seed,
+        'seconds': round(elapsed, 4),
+        'games_per_sec': round(games / elapsed, 2) if elapsed else None,
+        'output': output,
+        'output_bytes': os.path.getsize(output) if output else None
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description='Play AI agents against each other in bulk.')
+    parser.add_argument('--games', type=int, default=10000, help='games to play')
+    parser.add_argument('--x', default='alphabeta', help='agent playing X: minmax, alphabeta, mcts, random or '
+                                                        'epsilon:<e>[:<engine>]')
+    parser.add_argument('--o', default='alphabeta', help='agent playing O, as for --x')
+    parser.add_argument('--rows', type=int, default=3)
+    parser.add_argument('--cols', type=int, default=3)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='processes, 1 plays in this one')
+    parser.add_argument('--chunk', type=int, default=DEFAULT_CHUNK, help='games per worker task')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the first chunk, each chunk adds one')
+    parser.add_argument('--time-limit', type=float, default=None,
+                        help='seconds per engine move, searches to the end of the game if omitted')
+    parser.add_argument('--output', help='write the games to this file, overwriting it')
+    args = parser.parse_args(argv)
+
+    try:
+        summary = run(args.games, args.x, args.o, board_spec(args.rows, args.cols, args.k), args.workers,
+                      args.chunk, args.seed, args.time_limit, args.output)
+    except ValueError as e:
+        parser.error(str(e))
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+# Perfect-play table for the standard 3x3 game. Every position reachable from
+# the starting state (X moves first) is solved once and written to a small
+# binary file that is memory-mapped at startup, so get_best_move becomes a
+# single lookup. Build it ahead of time with `python -m app.solver [path]`;
+# the app builds it on first start if the file is missing.
+
+import mmap
+import os
+import struct
+import sys
+from typing import Optional, Tuple
+import numpy as np
+from app.batch_eval import O_CELL, X_CELL, batch_evaluator, ternary_boards
+from app.bitboard import CELLS, FULL, STANDARD, Bitboard
+
+MAGIC = b'TTT1'
+HEADER = struct.Struct('<4sI')
+RECORD = struct.Struct('<bH')  # minimax value for O, bitmask of best moves
+UNREACHABLE = 127
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), 'data', 'solved_table.bin')
+
+# Base-3 index of each 9-bit cell set, so a position maps to a record with
+# two list lookups: TERNARY[x] + 2 * TERNARY[o].
+TERNARY = [sum(3 ** i for i in range(CELLS) if bits >> i & 1) for bits in range(FULL + 1)]
+POSITIONS = 3 ** CELLS
+
+
+def position_index(board: Bitboard) -> int:
+    return TERNARY[board[0]] + 2 * TERNARY[board[1]]
+
+
+def solve() -> Tuple[np.ndarray, np.ndarray]:
+    """(value, best move mask) of every position, as arrays indexed by position_index.
+
+    Values are from O's point of view and relative to the position itself:
+    10 - plies for a forced O win, plies - 10 for a forced X win, 0 for a draw.
+    Positions that cannot be reached from the empty board get UNREACHABLE.
+
+    The whole state space is one (3^9, 9) board array: win flags come from
+    the batch evaluator, reachability is spread forward one stone at a time
+    and values are backed up from the last layer to the first.
+    """
+    boards = ternary_boards(CELLS)
+    o_wins, x_wins, _ = batch_evaluator(STANDARD).evaluate(boards)
+    stones = (boards != 0).sum(axis=1)
+    x_to_move = (boards == X_CELL).sum(axis=1) == (boards == O_CELL).sum(axis=1)
+    terminal = o_wins | x_wins | (stones == CELLS)
+    powers = 3 ** np.arange(CELLS, dtype=np.int32)
+
+    # children[i, c] is the position after the side to move plays cell c, -1 if c is taken
+    digit = np.where(x_to_move, 1, 2)[:, None]
+    children = np.where(boards == 0, np.arange(POSITIONS, dtype=np.int32)[:, None] + digit * powers, -1)
+
+    reachable = np.zeros(POSITIONS, dtype=bool)
+    reachable[0] = True
+    layers = []
+    for count in range(CELLS + 1):
+        layer = np.flatnonzero(reachable & (stones == count))
+        layers.append(layer)
+        parents = layer[~terminal[layer]]
+        targets = children[parents]
+        reachable[targets[targets >= 0]] = True
+
+    values = np.full(POSITIONS, UNREACHABLE, dtype=np.int8)
+    best_moves = np.zeros(POSITIONS, dtype=np.uint16)
+    values[reachable & terminal] = 0
+    values[reachable & o_wins] = 10
+    values[reachable & x_wins] = -10
+
+    for layer in reversed(layers):
+        parents = layer[~terminal[layer]]
+        if not len(parents):
+            continue
+        targets = children[parents]
+        taken = targets < 0
+        scores = values[np.where(taken, 0, targets)].astype(np.int16)
+        # One ply further from the end for this position
+        scores = scores - np.sign(scores)
+        o_to_move = ~x_to_move[parents][:, None]
+        # Occupied cells can never be the best choice for either side
+        scores = np.where(taken, np.where(o_to_move, -128, 127), scores)
+        best = np.where(o_to_move[:, 0], scores.max(axis=1), scores.min(axis=1))
+        values[parents] = best
+        best_moves[parents] = ((scores == best[:, None]) & ~taken).astype(np.uint16) @ (1 << np.arange(CELLS,
+                                                                                           dtype=np.uint16))
+    return values, best_moves
+
+
+def build_table() -> bytes:
+    values, best_moves = solve()
+    records = np.empty(POSITIONS, dtype=[('value', '<i1'), ('best_moves', '<u2')])
+    records['value'] = values
+    records['best_moves'] = best_moves
+    return HEADER.pack(MAGIC, POSITIONS) + records.tobytes()
+
+
+def write_table(path: str = DEFAULT_PATH) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(build_table())
+    os.replace(tmp_path, path)
+
+
+class SolvedTable:
+    def __init__(self, buffer):
+        magic, count = HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC or count != POSITIONS:
+            raise ValueError('Not a solved table file')
+        self.buffer = buffer
+
+    @classmethod
+    def open(cls, path: str) -> 'SolvedTable':
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def lookup(self, board: Bitboard) -> Optional[Tuple[int, int]]:
+        """Return (value, best move mask) or None if the position is unreachable."""
+        value, best_moves = RECORD.unpack_from(self.buffer, HEADER.size + position_index(board) * RECORD.size)
+        if value == UNREACHABLE:
+            return None
+        return value, best_moves
+
+    def best_move(self, board: Bitboard) -> Optional[Tuple[int, int]]:
+        """Lowest-index best move for O and its value, or None if O is not the side to move."""
+        x, o = board
+        if x.bit_count() != o.bit_count() + 1:
+            return None
+        record = self.lookup(board)
+        if record is None or not record[1]:
+            return None
+        value, best_moves = record
+        return (best_moves & -best_moves).bit_length() - 1, value
+
+
+solved_table: Optional[SolvedTable] = None
+
+
+def load_solved_table(path: str = DEFAULT_PATH) -> SolvedTable:
+    """Map the table into memory, building it first if the file is missing."""
+    global solved_table
+    if not os.path.exists(path):
+        try:
+            write_table(path)
+        except OSError:
+            # Read-only install, keep the freshly built table in memory
+            solved_table = SolvedTable(build_table())
+            return solved_table
+    solved_table = SolvedTable.open(path)
+    return solved_table
+
+
+def get_solved_table() -> Optional[SolvedTable]:
+    return solved_table
+
+
+if __name__ == '__main__':
+    target = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PATH
+    write_table(target)
+    print('Wrote %s' % target)
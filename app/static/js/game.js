@@ -10,11 +10,19 @@ document.addEventListener('DOMContentLoaded', () => {
     const treeContainer = document.getElementById('tree-container');
     const treeContent = document.getElementById('tree-content');
     const nodesCount = document.getElementById('nodes-count');
+    const tableHits = document.getElementById('table-hits');
     const currentAlgo = document.getElementById('current-algo');
     const algoButtons = document.querySelectorAll('.algo-btn');
     
+    const algoNames = { minmax: 'MinMax', alphabeta: 'Alpha-Beta', mcts: 'MCTS' };
+
     // Game state
     let currentAlgorithm = 'minmax';
+    let currentTree = null;
+    let nodeElements = new Map();
+    let pendingJob = null;
+    // Trees come as binary columns, 'stream' switches to NDJSON records
+    const treeFormat = 'binary';
 
     // Initialize panzoom
     const panzoomInstance = panzoom(treeContent, {
@@ -36,7 +44,7 @@ document.addEventListener('DOMContentLoaded', () => {
             algoButtons.forEach(btn => btn.classList.remove('active'));
             button.classList.add('active');
             currentAlgorithm = button.dataset.algo;
-            currentAlgo.textContent = currentAlgorithm === 'minmax' ? 'MinMax' : 'Alpha-Beta';
+            currentAlgo.textContent = algoNames[currentAlgorithm];
             resetGame();
         });
     });
@@ -53,7 +61,7 @@ document.addEventListener('DOMContentLoaded', () => {
         const cell = e.target;
         const position = cell.dataset.index;
 
-        if (cell.textContent || cell.classList.contains('X') || cell.classList.contains('O')) {
+        if (pendingJob || cell.textContent || cell.classList.contains('X') || cell.classList.contains('O')) {
             return;
         }
 
@@ -64,7 +72,11 @@ document.addEventListener('DOMContentLoaded', () => {
             },
             body: JSON.stringify({ 
                 position: parseInt(position),
-                algorithm: currentAlgorithm
+                algorithm: currentAlgorithm,
+                // Search live so the node counts reflect the chosen algorithm
+                live_search: true,
+                // Show our move right away and poll for the AI's
+                async: true
             })
         })
         .then(response => {
@@ -74,6 +86,35 @@ document.addEventListener('DOMContentLoaded', () => {
         .then(gameState => {
             updateGame(gameState);
             updateTree(gameState.board);
+            if (gameState.job_id) {
+                pendingJob = gameState.job_id;
+                status.textContent = 'AI is thinking...';
+                pollJob(gameState.job_id);
+            }
+        })
+        .catch(error => console.error('Error:', error));
+    }
+
+    function pollJob(jobId) {
+        fetch(`/jobs/${jobId}?wait=10`)
+        .then(response => {
+            if (!response.ok) throw new Error('Network response was not ok');
+            return response.json();
+        })
+        .then(job => {
+            // A reset since the move was sent makes the job stale
+            if (pendingJob !== jobId) return;
+            if (job.status === 'queued' || job.status === 'running') {
+                pollJob(jobId);
+                return;
+            }
+            pendingJob = null;
+            if (job.status === 'done') {
+                updateGame(job.result);
+                updateTree(job.result.board);
+            } else {
+                status.textContent = 'The AI could not move';
+            }
         })
         .catch(error => console.error('Error:', error));
     }
@@ -197,14 +238,22 @@ document.addEventListener('DOMContentLoaded', () => {
             prunedLabel.textContent = 'Pruned';
             nodeDiv.appendChild(prunedLabel);
         }
+
+        // Nodes cut off by the depth limit load their subtree on click
+        if (node.expandable) {
+            nodeDiv.classList.add('expandable');
+            nodeDiv.title = 'Click to expand';
+            nodeDiv.addEventListener('click', () => expandNode(node));
+        }
         
         return nodeDiv;
     }
     
     // Modify the existing renderTree function to handle pruned nodes
     function renderTree(treeData) {
+        currentTree = treeData;
         treeContent.innerHTML = '';
-        const nodeElements = new Map();
+        nodeElements = new Map();
         const levels = {};
     
         // Group nodes by depth
@@ -233,16 +282,6 @@ document.addEventListener('DOMContentLoaded', () => {
         // Initial draw of connections
         drawConnections(treeData, nodeElements);
     
-        // Update connections on transform
-        panzoomInstance.on('transform', (e) => {
-            const transform = e.getTransform();
-            drawConnections(treeData, nodeElements, {
-                x: transform.x,
-                y: transform.y,
-                scale: transform.scale
-            });
-        });
-    
         // Center the tree
         const treeContentRect = treeContent.getBoundingClientRect();
         const containerRect = treeContainer.getBoundingClientRect();
@@ -319,6 +358,149 @@ document.addEventListener('DOMContentLoaded', () => {
     }
     
 
+    // Update connections on transform, always for the tree on screen
+    panzoomInstance.on('transform', (e) => {
+        if (!currentTree) return;
+        const transform = e.getTransform();
+        drawConnections(currentTree, nodeElements, {
+            x: transform.x,
+            y: transform.y,
+            scale: transform.scale
+        });
+    });
+
+    // Calls onRecord for each line of an NDJSON response as it arrives
+    async function readNdjson(response, onRecord) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffered = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffered += decoder.decode(value, { stream: true });
+            const lines = buffered.split('\n');
+            buffered = lines.pop();
+            lines.forEach(line => {
+                if (line) onRecord(JSON.parse(line));
+            });
+        }
+        if (buffered) onRecord(JSON.parse(buffered));
+    }
+
+    function fetchTreeStream(url, body) {
+        const treeData = { nodes: [], edges: [], maxDepth: 0, nodesExplored: 0 };
+        return fetch(url, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ ...body, stream: true })
+        })
+        .then(response => {
+            if (!response.ok) throw new Error('Network response was not ok');
+            return readNdjson(response, record => {
+                if (record.type === 'node') {
+                    treeData.nodes.push(record);
+                } else if (record.type === 'edge') {
+                    treeData.edges.push(record);
+                } else if (record.type === 'summary') {
+                    treeData.maxDepth = record.maxDepth;
+                    treeData.nodesExplored = record.nodesExplored;
+                    treeData.truncated = record.truncated;
+                }
+            });
+        })
+        .then(() => treeData);
+    }
+
+    // Rebuilds the JSON nodes and edges from a binary tree, see CompactTree.to_bytes
+    function decodeTree(buffer) {
+        const view = new DataView(buffer);
+        const rows = view.getUint8(4);
+        const cols = view.getUint8(5);
+        const truncated = view.getUint8(7) !== 0;
+        const rootDepth = view.getUint16(8, true);
+        const maxDepth = view.getUint16(10, true);
+        const nodesExplored = view.getUint32(12, true);
+        const count = view.getUint32(16, true);
+        const rootIdLength = view.getUint16(20, true);
+        let offset = 22;
+        const rootId = new TextDecoder().decode(new Uint8Array(buffer, offset, rootIdLength));
+        offset += rootIdLength;
+        const cells = rows * cols;
+        const rootBoard = Array.from(new Uint8Array(buffer, offset, cells), code => ['', 'X', 'O'][code]);
+        offset += cells;
+        // Copied out, typed arrays must start on a multiple of their element size
+        const score = new Float64Array(buffer.slice(offset, offset + count * 8));
+        offset += count * 8;
+        const parent = new Int32Array(buffer.slice(offset, offset + count * 4));
+        offset += count * 4;
+        const move = new Int8Array(buffer, offset, count);
+        offset += count;
+        const flags = new Uint8Array(buffer, offset, count);
+
+        const treeData = { nodes: [], edges: [], maxDepth, nodesExplored, truncated };
+        // Parents always come before their children
+        for (let i = 0; i < count; i++) {
+            const isPruned = (flags[i] & 2) !== 0;
+            let node;
+            if (i === 0) {
+                node = { id: rootId, board: rootBoard, depth: rootDepth };
+            } else {
+                const parentNode = treeData.nodes[parent[i]];
+                const board = parentNode.board.slice();
+                board[move[i]] = parentNode.currentPlayer;
+                node = { id: `${parentNode.id}.${move[i]}`, board, depth: parentNode.depth + 1 };
+                treeData.edges.push({ from: parentNode.id, to: node.id, isPruned });
+            }
+            const xCount = node.board.filter(cell => cell === 'X').length;
+            const oCount = node.board.filter(cell => cell === 'O').length;
+            node.currentPlayer = xCount <= oCount ? 'X' : 'O';
+            node.score = score[i];
+            node.expandable = (flags[i] & 1) !== 0;
+            node.isPruned = isPruned;
+            treeData.nodes.push(node);
+        }
+        return treeData;
+    }
+
+    function fetchTree(url, body) {
+        if (treeFormat === 'stream') return fetchTreeStream(url, body);
+        return fetch(url, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ ...body, format: 'binary' })
+        })
+        .then(response => {
+            if (!response.ok) throw new Error('Network response was not ok');
+            return response.arrayBuffer();
+        })
+        .then(decodeTree);
+    }
+
+    function expandNode(node) {
+        fetchTree('/expand_node', {
+            board: node.board,
+            node_id: node.id,
+            node_depth: node.depth,
+            algorithm: currentAlgorithm
+        })
+        .then(subtree => {
+            if (!currentTree) return;
+            // The expanded node is already on screen, only its descendants are new
+            node.expandable = false;
+            subtree.nodes.forEach(child => {
+                if (child.id !== node.id) currentTree.nodes.push(child);
+            });
+            currentTree.edges.push(...subtree.edges);
+            currentTree.maxDepth = Math.max(currentTree.maxDepth, subtree.maxDepth);
+            renderTree(currentTree);
+        })
+        .catch(error => console.error('Error:', error));
+    }
+
     function updateGame(gameState) {
         gameState.board.forEach((mark, index) => {
             const cell = cells[index];
@@ -330,7 +512,8 @@ document.addEventListener('DOMContentLoaded', () => {
         // Update stats
         if (gameState.ai_stats) {
             nodesCount.textContent = gameState.ai_stats.nodes_explored;
-            currentAlgo.textContent = gameState.ai_stats.algorithm === 'minmax' ? 'MinMax' : 'Alpha-Beta';
+            tableHits.textContent = gameState.ai_stats.table_hits;
+            currentAlgo.textContent = algoNames[gameState.ai_stats.algorithm];
         }
 
         if (gameState.game_over) {
@@ -343,25 +526,16 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     function updateTree(board) {
-        fetch('/get_tree', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({ 
-                board: board,
-                algorithm: currentAlgorithm 
-            })
-        })
-        .then(response => {
-            if (!response.ok) throw new Error('Network response was not ok');
-            return response.json();
+        fetchTree('/get_tree', {
+            board: board,
+            algorithm: currentAlgorithm
         })
         .then(renderTree)
         .catch(error => console.error('Error:', error));
     }
 
     function resetGame() {
+        pendingJob = null;
         fetch('/reset', {
             method: 'POST',
         })
@@ -0,0 +1,156 @@
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Iterable, Optional, Tuple
+from app.bitboard import BoardSpec
+
+# Entries are keyed by (dims, canonical board, is_maximizing, weights). Results
+# of searches that reached the end of the game hold for every engine and
+# have None for weights; results resting on heuristic leaves are only valid
+# for the evaluator weights that scored those leaves.
+
+# Entry flags: the stored score is exact, a lower bound (fail high) or an
+# upper bound (fail low) of the true minimax value.
+EXACT = 0
+LOWER = 1
+UPPER = 2
+
+# Draft (remaining search depth) recorded for results of searches that ran
+# all the way to terminal positions.
+FULL_DRAFT = 1 << 16
+
+TableEntry = Tuple[int, float, Optional[int], int]
+
+
+def entry_key(spec: BoardSpec, canonical: Tuple[int, int], is_maximizing: bool, draft: int,
+              weights: Optional[Tuple[int, ...]]) -> Tuple:
+    return spec.dims, canonical, is_maximizing, None if draft >= FULL_DRAFT else weights
+
+
+def to_table_score(score: float, depth: int) -> float:
+    # Win/loss scores carry the distance from the search root; store them
+    # relative to the node so the entry is valid at any depth. Heuristic
+    # leaf scores always lie strictly between -1 and 1 and are left alone.
+    if score >= 1:
+        return score + depth
+    if score <= -1:
+        return score - depth
+    return score
+
+
+def from_table_score(score: float, depth: int) -> float:
+    if score >= 1:
+        return score - depth
+    if score <= -1:
+        return score + depth
+    return score
+
+
+class TranspositionTable:
+    def __init__(self, max_entries: int = 65536):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def lookup(self, spec: BoardSpec, canonical: Tuple[int, int], is_maximizing: bool,
+               weights: Optional[Tuple[int, ...]]) -> Tuple[Optional[Tuple], Optional[TableEntry]]:
+        """The key and entry of a position, preferring a search to the end of
+        the game over one with weights. Called with the lock held."""
+        key = entry_key(spec, canonical, is_maximizing, FULL_DRAFT, weights)
+        entry = self.entries.get(key)
+        if entry is None and weights is not None:
+            key = entry_key(spec, canonical, is_maximizing, 0, weights)
+            entry = self.entries.get(key)
+        return key, entry
+
+    def probe(self, spec: BoardSpec, x: int, o: int, is_maximizing: bool, depth: int,
+              draft: int = FULL_DRAFT, weights: Optional[Tuple[int, ...]] = None) -> Optional[TableEntry]:
+        """Look up a position searched at least `draft` plies deep, returning (flag, score, move, draft).
+
+        Entries below FULL_DRAFT are only found with the weights they were stored with.
+        """
+        canonical, transform = spec.canonical(x, o)
+        with self.lock:
+            key, entry = self.lookup(spec, canonical, is_maximizing, weights if draft < FULL_DRAFT else None)
+            if entry is None or entry[3] < draft:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+        flag, score, move, entry_draft = entry
+        if move is not None:
+            move = spec.symmetries[transform][move]
+        return flag, from_table_score(score, depth), move, entry_draft
+
+    def store(self, spec: BoardSpec, x: int, o: int, is_maximizing: bool, depth: int, flag: int,
+              score: float, move: Optional[int], draft: int = FULL_DRAFT,
+              weights: Optional[Tuple[int, ...]] = None) -> None:
+        canonical, transform = spec.canonical(x, o)
+        if move is not None:
+            move = spec.symmetries[transform].index(move)
+        key = entry_key(spec, canonical, is_maximizing, draft, weights)
+        with self.lock:
+            self.entries[key] = (flag, to_table_score(score, depth), move, draft)
+            self.entries.move_to_end(key)
+            # Evict least recently used positions once the table is full
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def peek(self, spec: BoardSpec, x: int, o: int, is_maximizing: bool, depth: int = 0,
+             weights: Optional[Tuple[int, ...]] = None) -> Optional[TableEntry]:
+        """probe without a draft requirement, leaving the counters and the LRU order alone."""
+        canonical, transform = spec.canonical(x, o)
+        with self.lock:
+            entry = self.lookup(spec, canonical, is_maximizing, weights)[1]
+        if entry is None:
+            return None
+        flag, score, move, entry_draft = entry
+        if move is not None:
+            move = spec.symmetries[transform][move]
+        return flag, from_table_score(score, depth), move, entry_draft
+
+    def export(self, spec: BoardSpec, positions: Iterable[Tuple[int, int, bool]],
+               weights: Optional[Tuple[int, ...]] = None) -> Dict[Tuple, Tuple]:
+        """The raw entries of the given (x, o, is_maximizing) positions that are in the table.
+
+        Raw entries are in canonical, node relative form, so restore() can put
+        them back whatever depth the positions are met at later.
+        """
+        keys = set()
+        for x, o, is_maximizing in positions:
+            canonical = spec.canonical(x, o)[0]
+            keys.add(entry_key(spec, canonical, is_maximizing, FULL_DRAFT, weights))
+            if weights is not None:
+                keys.add(entry_key(spec, canonical, is_maximizing, 0, weights))
+        with self.lock:
+            return {key: self.entries[key] for key in keys if key in self.entries}
+
+    def restore(self, entries: Dict[Tuple, Tuple]) -> None:
+        """Put exported entries back, keeping any that have been searched deeper since."""
+        with self.lock:
+            for key, entry in entries.items():
+                current = self.entries.get(key)
+                if current is None or current[3] < entry[3]:
+                    self.entries[key] = entry
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+
+# One table shared by every engine instance so results survive between requests
+shared_table = TranspositionTable()
@@ -0,0 +1,238 @@
+# Search trees. A node is named by the moves leading to it from the root, so
+# IDs are stable across processes and requests, cannot collide within a tree,
+# and a subtree grown from a node keeps extending its ID.
+#
+# The engines build slotted TreeNodes, numbered as they are created so every
+# parent is numbered below its children. A finished tree is kept as the
+# CompactTree columns: for each node its parent's number, the move leading to
+# it, its score and flags. Edges and boards follow from parent and move, so
+# neither is stored. The tree goes out as the original JSON nodes and edges,
+# as the columns in JSON, or as the columns in binary (see to_bytes()).
+
+import struct
+import sys
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence
+from app.bitboard import Bitboard, BoardSpec, player_to_move
+
+ROOT_ID = 'r'
+
+# TreeNode flags
+EXPANDABLE = 1  # Cut off by the depth limit or node ceiling, the client may ask for its subtree
+PRUNED = 2  # Skipped by an alpha-beta cutoff, shown as a leaf
+
+TREE_FORMATS = ('json', 'columnar', 'binary')
+
+# Binary header: magic, rows, cols, k, truncated, root depth, max depth,
+# nodes explored, node count, then the length of the root ID that follows it
+BINARY_MAGIC = b'TTTT'
+BINARY_HEADER = struct.Struct('<4sBBBBHHIIH')
+
+# Cell codes of the root board in the binary format
+CELL_CODES = {'': 0, 'X': 1, 'O': 2}
+
+
+def child_id(parent_id: str, move: int) -> str:
+    return '%s.%d' % (parent_id, move)
+
+
+def pack_board(spec: BoardSpec, board: Bitboard) -> int:
+    """Both sides' cells as one integer, X in the low spec.cells bits."""
+    return board[0] | board[1] << spec.cells
+
+
+def unpack_board(spec: BoardSpec, packed: int) -> Bitboard:
+    return packed & spec.full, packed >> spec.cells
+
+
+class TreeNode:
+    __slots__ = ('index', 'parent', 'move', 'board', 'score', 'depth', 'flags')
+
+    def __init__(self, index: int, parent: Optional['TreeNode'], move: int, board: int, depth: int,
+                 score: float = 0, flags: int = 0):
+        self.index = index
+        self.parent = parent
+        self.move = move  # Move that led here from parent, -1 at the root
+        self.board = board  # See pack_board()
+        self.depth = depth
+        self.score = score
+        self.flags = flags
+
+    def node_id(self, root_id: str = ROOT_ID) -> str:
+        moves = []
+        node = self
+        while node.parent is not None:
+            moves.append(node.move)
+            node = node.parent
+        node_id = root_id
+        for move in reversed(moves):
+            node_id = child_id(node_id, move)
+        return node_id
+
+
+def json_score(score: float) -> float:
+    # Scores are held as floats, whole ones go out as they always have
+    return int(score) if score == int(score) else score
+
+
+def node_records(spec: BoardSpec, node: TreeNode, root_id: str = ROOT_ID) -> Iterator[Dict]:
+    """node as the original JSON node record, then its edge record unless it is the root."""
+    node_id = node.node_id(root_id)
+    board = unpack_board(spec, node.board)
+    pruned = bool(node.flags & PRUNED)
+    yield {
+        'type': 'node',
+        'id': node_id,
+        'board': spec.decode(board),
+        'score': json_score(node.score),
+        'depth': node.depth,
+        'expandable': bool(node.flags & EXPANDABLE),
+        'isPruned': pruned,
+        'currentPlayer': player_to_move(board)
+    }
+    if node.parent is not None:
+        yield {
+            'type': 'edge',
+            'from': node.parent.node_id(root_id),
+            'to': node_id,
+            'isPruned': pruned
+        }
+
+
+def little_endian(column: array) -> bytes:
+    if sys.byteorder == 'big':
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+class CompactTree:
+    """A built search tree as columns indexed by node number."""
+
+    def __init__(self, spec: BoardSpec, board: Bitboard, max_depth: int, root_depth: int = 0,
+                 root_id: str = ROOT_ID):
+        self.spec = spec
+        self.board = board
+        self.max_depth = max_depth
+        self.root_depth = root_depth
+        self.root_id = root_id
+        self.parent = array('i')
+        self.move = array('b')
+        self.score = array('d')
+        self.flags = array('B')
+        self.nodes_explored = 0
+        self.truncated = False
+
+    @classmethod
+    def from_nodes(cls, spec: BoardSpec, nodes: Iterable[TreeNode], max_depth: int, root_depth: int = 0,
+                   root_id: str = ROOT_ID) -> 'CompactTree':
+        ordered = sorted(nodes, key=lambda node: node.index)
+        tree = cls(spec, unpack_board(spec, ordered[0].board), max_depth, root_depth, root_id)
+        # Renumber densely, a ceiling can leave gaps
+        position = {}
+        for node in ordered:
+            position[node.index] = len(tree.parent)
+            tree.parent.append(-1 if node.parent is None else position[node.parent.index])
+            tree.move.append(node.move)
+            tree.score.append(node.score)
+            tree.flags.append(node.flags)
+        return tree
+
+    def __len__(self) -> int:
+        return len(self.parent)
+
+    def relabelled(self, cells: Sequence[int], board: Bitboard) -> 'CompactTree':
+        """The same tree grown from board, with every move m played on cells[m] instead.
+
+        cells is a symmetry of the board, so board must be the root's image
+        under it and every score stays as it is.
+        """
+        tree = CompactTree(self.spec, board, self.max_depth, self.root_depth, self.root_id)
+        tree.parent = array('i', self.parent)
+        tree.move = array('b', [-1] + [cells[move] for move in self.move[1:]])
+        tree.score = array('d', self.score)
+        tree.flags = array('B', self.flags)
+        tree.nodes_explored = self.nodes_explored
+        tree.truncated = self.truncated
+        return tree
+
+    def boards(self) -> List[Bitboard]:
+        """Every node's board, replayed from the root."""
+        boards = [self.board]
+        for i in range(1, len(self)):
+            x, o = boards[self.parent[i]]
+            if player_to_move((x, o)) == 'X':
+                boards.append((x | 1 << self.move[i], o))
+            else:
+                boards.append((x, o | 1 << self.move[i]))
+        return boards
+
+    def depths(self) -> List[int]:
+        depths = [self.root_depth]
+        for i in range(1, len(self)):
+            depths.append(depths[self.parent[i]] + 1)
+        return depths
+
+    def node_ids(self) -> List[str]:
+        ids = [self.root_id]
+        for i in range(1, len(self)):
+            ids.append(child_id(ids[self.parent[i]], self.move[i]))
+        return ids
+
+    def to_dict(self) -> Dict:
+        """The original nodes and edges JSON."""
+        spec = self.spec
+        ids = self.node_ids()
+        depths = self.depths()
+        nodes = []
+        edges = []
+        for i, board in enumerate(self.boards()):
+            pruned = bool(self.flags[i] & PRUNED)
+            nodes.append({
+                'id': ids[i],
+                'board': spec.decode(board),
+                'score': json_score(self.score[i]),
+                'depth': depths[i],
+                'expandable': bool(self.flags[i] & EXPANDABLE),
+                'isPruned': pruned,
+                'currentPlayer': player_to_move(board)
+            })
+            if i:
+                edges.append({'from': ids[self.parent[i]], 'to': ids[i], 'isPruned': pruned})
+        return {
+            'nodes': nodes,
+            'edges': edges,
+            'maxDepth': self.max_depth,
+            'nodesExplored': self.nodes_explored,
+            'truncated': self.truncated
+        }
+
+    def to_columns(self) -> Dict:
+        """The columns as JSON lists, the root's parent and move are -1."""
+        return {
+            'format': 'columnar',
+            'rows': self.spec.rows,
+            'cols': self.spec.cols,
+            'k': self.spec.k,
+            'rootId': self.root_id,
+            'rootDepth': self.root_depth,
+            'board': self.spec.decode(self.board),
+            'parent': self.parent.tolist(),
+            'move': self.move.tolist(),
+            'score': [json_score(score) for score in self.score],
+            'flags': self.flags.tolist(),
+            'maxDepth': self.max_depth,
+            'nodesExplored': self.nodes_explored,
+            'truncated': self.truncated
+        }
+
+    def to_bytes(self) -> bytes:
+        """The header, the root ID in UTF-8, one byte per root cell (CELL_CODES),
+        then the columns, all little-endian: score float64, parent int32, move
+        int8 and flags uint8."""
+        root_id = self.root_id.encode('utf-8')
+        header = BINARY_HEADER.pack(BINARY_MAGIC, self.spec.rows, self.spec.cols, self.spec.k, self.truncated,
+                                    self.root_depth, self.max_depth, self.nodes_explored, len(self), len(root_id))
+        cells = bytes(CELL_CODES[cell] for cell in self.spec.decode(self.board))
+        return b''.join((header, root_id, cells, little_endian(self.score), little_endian(self.parent),
+                         self.move.tobytes(), self.flags.tobytes()))
@@ -0,0 +1,82 @@
+# Built search trees shared by every game of the process. The tree for a
+# position only depends on the board, the algorithm, the engine's settings
+# (its evaluator weights, or its iterations for MCTS) and the limits, and
+# most players pass through the same few early positions, so /get_tree
+# answers those from here. MCTS trees differ from search to search and are
+# not put here. Trees are kept in the canonical frame of their board (see
+# BoardSpec.canonical) and relabelled on the way out, so a position hits the
+# entry of any of its symmetric images.
+
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Hashable, Optional
+from app.bitboard import Bitboard, BoardSpec
+from app.tree import CompactTree
+
+
+class TreeCache:
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # least recently used first
+        self.hits = 0
+        self.symmetric_hits = 0  # Hits served through a symmetry of the cached board
+        self.misses = 0
+        self.evictions = 0
+        self.lock = Lock()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def get(self, spec: BoardSpec, board: Bitboard, algorithm: str, settings: Hashable, depth: int,
+            max_nodes: int) -> Optional[CompactTree]:
+        canonical, transform = spec.canonical(*board)
+        key = (spec.dims, canonical, algorithm, settings, depth, max_nodes)
+        with self.lock:
+            tree = self.entries.get(key)
+            if tree is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            if transform:
+                self.symmetric_hits += 1
+        if not transform:
+            return tree
+        return tree.relabelled(spec.symmetries[transform], board)
+
+    def put(self, spec: BoardSpec, board: Bitboard, algorithm: str, settings: Hashable, depth: int,
+            max_nodes: int, tree: CompactTree) -> None:
+        canonical, transform = spec.canonical(*board)
+        if transform:
+            # Canonical cell i holds the original cell perm[i], so moves map back through the inverse
+            perm = spec.symmetries[transform]
+            cells = [0] * spec.cells
+            for i, source in enumerate(perm):
+                cells[source] = i
+            tree = tree.relabelled(cells, (spec.transform(board[0], transform), spec.transform(board[1], transform)))
+        key = (spec.dims, canonical, algorithm, settings, depth, max_nodes)
+        with self.lock:
+            self.entries[key] = tree
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def to_dict(self) -> Dict:
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'symmetric_hits': self.symmetric_hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.hits = 0
+            self.symmetric_hits = 0
+            self.misses = 0
+            self.evictions = 0